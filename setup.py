@@ -17,5 +17,8 @@ setup(
     author_email='chris.c.mccomb@gmail.com',
     url='https://github.com/cmccomb/truss-me',
     license=license,
-    packages=find_packages(exclude=('tests', 'docs'))
+    packages=find_packages(exclude=('tests', 'docs')),
+    entry_points={
+        'console_scripts': ['trussme-batch=trussme.batch:main'],
+    }
 )
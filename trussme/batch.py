@@ -0,0 +1,227 @@
+import argparse
+import contextlib
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import numpy as np
+from trussme import report
+from trussme import truss
+
+# Extensions of the files a directory is searched for
+extensions = [".trs", ".trsb"]
+
+# Result formats written per file
+formats = ["json", "csv", "npz"]
+
+# Environment variables that set the thread count of the BLAS libraries
+BLAS_THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                         "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                         "NUMEXPR_NUM_THREADS"]
+
+
+def find_files(paths):
+    # Truss files in the given directories, glob patterns and file names,
+    # each listed once, in sorted order within a directory or pattern
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(os.path.join(path, name)
+                           for name in os.listdir(path)
+                           if os.path.splitext(name)[1] in extensions)
+        elif os.path.exists(path):
+            found = [path]
+        else:
+            found = sorted(glob.glob(path))
+        for file_name in found:
+            if file_name not in files:
+                files.append(file_name)
+    return files
+
+
+def analyze_file(file_name, output_dir="", write_report=False,
+                 results_format="", solver="auto", condition="estimate"):
+    # Load and analyze one file, and optionally write its report and
+    # results. Errors are caught, so one bad file cannot stop a batch.
+    summary = {"file": file_name,
+               "mass": np.nan,
+               "fos_total": np.nan,
+               "fos_yielding": np.nan,
+               "fos_buckling": np.nan,
+               "limit_state": "N/A",
+               "error": "",
+               "time": 0.0}
+    start = time.time()
+    try:
+        t = truss.Truss(file_name)
+        # Mechanisms are rejected before any solve, so the solver does not
+        # check again
+        t.check_stability()
+        r = t.results(solver=solver, condition=condition, precheck=False)
+        summary.update(mass=r.mass,
+                       fos_total=r.summary["fos_total"],
+                       fos_yielding=r.summary["fos_yielding"],
+                       fos_buckling=r.summary["fos_buckling"],
+                       limit_state=r.limit_state)
+
+        base_name = os.path.join(output_dir or os.path.dirname(file_name),
+                                 os.path.splitext(
+                                     os.path.basename(file_name))[0])
+        if write_report:
+            t.save_report(base_name + "_report.txt")
+        if results_format == "json":
+            r.write_json(base_name + "_results.json")
+        elif results_format == "csv":
+            r.write_csv(base_name + "_members.csv", table="members")
+            r.write_csv(base_name + "_joints.csv", table="joints")
+        elif results_format == "npz":
+            r.write_npz(base_name + "_results.npz")
+    except Exception as e:
+        summary["error"] = type(e).__name__ + ": " + str(e)
+        summary["traceback"] = traceback.format_exc()
+    summary["time"] = time.time() - start
+    return summary
+
+
+def _analyze(arguments):
+    # Pool workers take a single argument
+    file_name, options = arguments
+    return analyze_file(file_name, **options)
+
+
+@contextlib.contextmanager
+def blas_threads(count):
+    # Set the BLAS thread count in the environment, which the worker
+    # processes inherit when they start, and restore it afterwards
+    saved = dict((name, os.environ.get(name))
+                 for name in BLAS_THREAD_VARIABLES)
+    if count is not None:
+        for name in BLAS_THREAD_VARIABLES:
+            os.environ[name] = str(count)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def run_batch(files, workers=None, chunksize=1, threads_per_worker=1,
+              callback=None, **options):
+    # Analyze many files on a pool of worker processes and return one
+    # summary per file, in the order of files. options are passed on to
+    # analyze_file, and callback is called with each summary as it arrives.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(files)))
+    tasks = [(file_name, options) for file_name in files]
+
+    summaries = []
+    if workers == 1:
+        # No pool for a single worker, which also keeps debugging simple
+        for task in tasks:
+            summaries.append(_analyze(task))
+            if callback is not None:
+                callback(summaries[-1])
+        return summaries
+
+    # Workers are spawned, not forked, so that they start with the BLAS
+    # thread limit and do not inherit the state of the parent process
+    context = multiprocessing.get_context("spawn")
+    with blas_threads(threads_per_worker):
+        pool = context.Pool(workers)
+    try:
+        for summary in pool.imap(_analyze, tasks, chunksize=chunksize):
+            summaries.append(summary)
+            if callback is not None:
+                callback(summary)
+    finally:
+        pool.close()
+        pool.join()
+    return summaries
+
+
+def format_summary(summaries):
+    # Text table of mass, FOS and limit state per file
+    return report.format_table(
+        [s["file"] for s in summaries],
+        ["Mass", "FOS-total", "FOS-yielding", "FOS-buckling", "Limit-state",
+         "Error"],
+        [[float(s["mass"]) for s in summaries],
+         [float(s["fos_total"]) for s in summaries],
+         [float(s["fos_yielding"]) for s in summaries],
+         [float(s["fos_buckling"]) for s in summaries],
+         [s["limit_state"] for s in summaries],
+         [s["error"] or "-" for s in summaries]])
+
+
+def write_summary(summaries, file_name):
+    # The summary as CSV, one row per file
+    columns = ["file", "mass", "fos_total", "fos_yielding", "fos_buckling",
+               "limit_state", "error", "time"]
+    with open(file_name, "w") as f:
+        f.write(",".join(columns) + "\n")
+        for s in summaries:
+            f.write(",".join('"' + str(s[c]).replace('"', '""') + '"'
+                             if c in ["file", "limit_state", "error"]
+                             else repr(float(s[c])) for c in columns) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="trussme-batch",
+        description="Analyze many truss files in parallel.")
+    parser.add_argument("paths", nargs="+",
+                        help="directories, glob patterns or truss files")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per "
+                             "CPU)")
+    parser.add_argument("--chunksize", type=int, default=1,
+                        help="files handed to a worker at a time")
+    parser.add_argument("--threads-per-worker", type=int, default=1,
+                        help="BLAS threads per worker (default: 1)")
+    parser.add_argument("-o", "--output-dir", default="",
+                        help="directory for reports and results (default: "
+                             "next to each input file)")
+    parser.add_argument("--report", action="store_true",
+                        help="write a text report per file")
+    parser.add_argument("--results", choices=formats, default="",
+                        help="write results per file in this format")
+    parser.add_argument("--solver", default="auto",
+                        help="solver passed to calc_fos")
+    parser.add_argument("--summary", default="",
+                        help="also write the summary as CSV to this file")
+    args = parser.parse_args(argv)
+
+    files = find_files(args.paths)
+    if len(files) == 0:
+        parser.error("no truss files found")
+    if args.output_dir != "" and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    start = time.time()
+    summaries = run_batch(files, workers=args.workers,
+                          chunksize=args.chunksize,
+                          threads_per_worker=args.threads_per_worker,
+                          output_dir=args.output_dir,
+                          write_report=args.report,
+                          results_format=args.results, solver=args.solver)
+
+    print(format_summary(summaries))
+    failed = [s for s in summaries if s["error"] != ""]
+    for s in failed:
+        sys.stderr.write(s["file"] + "\n" + s["traceback"])
+    print("\n" + str(len(summaries)) + " files, " + str(len(failed)) +
+          " failed, " + format(time.time() - start, '.2f') + " s")
+    if args.summary != "":
+        write_summary(summaries, args.summary)
+
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
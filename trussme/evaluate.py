@@ -1,61 +1,1594 @@
+import abc
+import hashlib
+import time
+import warnings
 import numpy as np
 
+# SciPy is only needed for the sparse backend and the LAPACK condition
+# estimate of the dense backend
+try:
+    import scipy.linalg
+    import scipy.linalg.lapack
+    import scipy.sparse
+    import scipy.sparse.linalg
+    from scipy.sparse.csgraph import reverse_cuthill_mckee
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
 
-def the_forces(truss_info):
-    tj = np.zeros([3, np.size(truss_info["connections"], axis=1)])
-    w = np.array([np.size(truss_info["reactions"], axis=0),
-                  np.size(truss_info["reactions"], axis=1)])
-    dof = np.zeros([3*w[1], 3*w[1]])
-    deflections = np.ones(w)
-    deflections -= truss_info["reactions"]
+# Solver backends accepted by the_forces, by name, as registered with
+# register_backend. "auto" lets pick_solver choose one.
+backends = {}
+solvers = ["auto"]
+
+# Preconditioners of the iterative backend
+preconditioners = ["jacobi", "ic", "amg"]
+
+# Condition number modes accepted by the_forces
+conditions = ["estimate", "exact", "off"]
+
+# Above these condition numbers, per mode, results may be inaccurate. The
+# limit was set for the exact 2-norm condition number. No fixed factor
+# relates the 1-norm estimate to it: the two norms of an n by n matrix
+# differ by up to a factor of n either way, and the estimate of the 1-norm
+# condition number is a lower bound, usually within a factor of 3. On the
+# test trusses the estimate runs 1.2 to 2.3 times higher, about 1.6 for
+# long trusses, so its limit is doubled. Near the limit, a truss may warn
+# in one mode but not the other.
+CONDITION_LIMITS = {"estimate": 2*pow(10, 5), "exact": pow(10, 5),
+                    "off": np.inf}
+
+# Buckling FOS used for members in tension, which cannot buckle
+NO_BUCKLING_FOS = 10000
+
+# Above this number of degrees of freedom, "auto" picks the sparse backend
+SPARSE_DOF_THRESHOLD = 600
+
+# Above this fraction of nonzero entries in K_ff, "auto" keeps the Cholesky
+# backend at any size
+DENSE_DENSITY_THRESHOLD = 0.1
+
+# Above this number of degrees of freedom, "auto" picks the iterative backend
+# for at most ITERATIVE_MAX_CASES load cases, since every case needs its own
+# iterations while a factorization is shared
+ITERATIVE_DOF_THRESHOLD = 200000
+ITERATIVE_MAX_CASES = 4
+
+# Matrix entries batch_forces assembles at once, about 128 MB of doubles
+BATCH_ENTRIES = 2**24
+
+# Members whose EA may change before a cached factorization is refactored
+# instead of updated. Each changed member costs one extra solve.
+MAX_UPDATES = 8
+
+# Backward error above which an updated solution is discarded and the
+# stiffness matrix is refactored
+UPDATE_TOLERANCE = 1e-10
+
+# Smallest pivot of a Cholesky factorization, relative to the diagonal of
+# K_ff, that is not taken for a mechanism. A truss that cannot resist load
+# in some direction leaves a pivot of about this size from rounding.
+MECHANISM_TOLERANCE = 1e-12
+
+# Relative residual at which the iterative backend stops, and the drop
+# tolerance and fill factor of its incomplete Cholesky preconditioner
+ITERATIVE_TOLERANCE = 1e-10
+IC_DROP_TOLERANCE = 1e-2
+IC_FILL_FACTOR = 3
+
+# Diagonal shifts, relative to the diagonal, tried in turn when dropped
+# entries leave the incomplete Cholesky factorization without positive
+# pivots
+IC_SHIFTS = [0.0, 1e-3, 1e-2, 1e-1, 1.0]
+
+
+def member_geometry(truss_info):
+    # Unit direction vectors, shape (3, m), and lengths of all members
+    connections = truss_info["connections"]
+    coordinates = truss_info["coordinates"]
+    length_vectors = coordinates[:, connections[1, :]] \
+        - coordinates[:, connections[0, :]]
+    lengths = np.sqrt(np.sum(length_vectors**2, axis=0))
+    return length_vectors/lengths, lengths
+
+
+def assemble_stiffness(truss_info, sparse=False):
+    connections = truss_info["connections"]
+    number_of_joints = np.size(truss_info["coordinates"], axis=1)
+
+    # Member direction vectors, lengths and axial stiffnesses in one pass
+    directions, lengths = member_geometry(truss_info)
+    ea_over_l = truss_info["elastic_modulus"]*truss_info["area"]/lengths
+    tj = ea_over_l*directions
+
+    # Stack the 6x6 member stiffness matrices along the first axis
+    d2 = directions.T[:, :, None]*directions.T[:, None, :]
+    ss = ea_over_l[:, None, None]*np.concatenate(
+        (np.concatenate((d2, -d2), axis=2),
+         np.concatenate((-d2, d2), axis=2)), axis=1)
+
+    # Global DOF numbers of both member ends, then scatter-add every block.
+    # np.add.at accumulates in member order, just like the old nested loop.
+    e = np.hstack((3*connections[0, :, None] + np.arange(3),
+                   3*connections[1, :, None] + np.arange(3)))
+    if sparse:
+        # COO duplicates are summed when converting to CSR
+        rows = np.broadcast_to(e[:, :, None], ss.shape).ravel()
+        cols = np.broadcast_to(e[:, None, :], ss.shape).ravel()
+        dof = scipy.sparse.coo_matrix(
+            (ss.ravel(), (rows, cols)),
+            shape=(3*number_of_joints, 3*number_of_joints)).tocsr()
+        return dof, tj
+
+    dof = np.zeros([3*number_of_joints, 3*number_of_joints])
+    np.add.at(dof, (e[:, :, None], e[:, None, :]), ss)
+
+    return dof, tj
+
+
+def stiffness_density(number_of_joints, number_of_members):
+    # Upper bound on the fraction of nonzero entries in the stiffness
+    # matrix: a 3x3 block per joint and two per member
+    number_of_dofs = max(3*number_of_joints, 1)
+    return min(1.0, 9.0*(number_of_joints + 2*number_of_members)
+               / number_of_dofs**2)
+
+
+def pick_solver(number_of_dofs, density=0.0, number_of_cases=1):
+    # The backend "auto" stands for, from the size and density of the
+    # stiffness matrix and the number of load cases to solve
+    if not HAS_SCIPY:
+        return "dense"
+    elif number_of_dofs <= SPARSE_DOF_THRESHOLD or \
+            density > DENSE_DENSITY_THRESHOLD:
+        return "cholesky"
+    elif number_of_dofs > ITERATIVE_DOF_THRESHOLD and \
+            number_of_cases <= ITERATIVE_MAX_CASES:
+        return "iterative"
+    else:
+        return "sparse"
+
+
+class Factorization(object):
+
+    def __init__(self, SSff):
+        self.matrix = SSff
+
+        # Condition numbers are computed at most once per mode, and so is
+        # the 1-norm
+        self.conditions = {}
+        self.norm = None
+
+        # Stored entries of the factors, or None if not known
+        self.fill = None
+
+    def condition(self, mode="estimate"):
+        if mode == "off":
+            return np.nan
+        if mode not in self.conditions:
+            self.conditions[mode] = self.calc_condition(mode)
+        return self.conditions[mode]
+
+    def one_norm(self):
+        if self.norm is None:
+            self.norm = np.max(abs(self.matrix).sum(axis=0))
+        return self.norm
+
+    def dot(self, flat_deflections):
+        return self.matrix.dot(flat_deflections)
+
+    def full_matrix(self):
+        # K_ff as a dense array
+        if hasattr(self.matrix, "toarray"):
+            return self.matrix.toarray()
+        return self.matrix
+
+
+class DenseFactorization(Factorization):
+
+    def __init__(self, SSff):
+        Factorization.__init__(self, SSff)
+
+        # LU factorization, kept so that later solves and the condition
+        # estimate do not have to factor again
+        self.fill = SSff.size
+        if HAS_SCIPY:
+            # An exact zero pivot is reported below as a mechanism, not
+            # as a warning
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", scipy.linalg.LinAlgWarning)
+                self.lu = scipy.linalg.lu_factor(SSff, check_finite=False)
+
+            # Rows are only swapped, so a pivot that rounding has left of
+            # zero is small next to the rest of its column, as in the
+            # Cholesky check
+            small = ~(np.abs(np.diag(self.lu[0])) >
+                      MECHANISM_TOLERANCE*np.max(np.abs(SSff), axis=0))
+            if np.any(small):
+                raise MechanismError(mode=self.mechanism(np.argmax(small)))
+        else:
+            self.lu = None
+
+    def mechanism(self, k):
+        # The deflection that moves DOF k and deforms no member, which the
+        # leading k columns of U hold against column k
+        mode = np.zeros(len(self.matrix))
+        mode[k] = 1.0
+        if k > 0:
+            mode[:k] = -scipy.linalg.solve_triangular(
+                self.lu[0][:k, :k], self.lu[0][:k, k], check_finite=False)
+        return mode
+
+    def solve(self, flat_loads):
+        if self.lu is not None:
+            return scipy.linalg.lu_solve(self.lu, flat_loads,
+                                         check_finite=False)
+        else:
+            return np.linalg.solve(self.matrix, flat_loads)
+
+    def calc_condition(self, mode):
+        if mode == "exact":
+            return np.linalg.cond(self.matrix)
+        elif self.lu is not None:
+            # LAPACK gecon 1-norm estimate from the existing LU factors
+            rcond, info = scipy.linalg.lapack.dgecon(
+                self.lu[0], np.linalg.norm(self.matrix, 1), norm='1')
+            return 1.0/rcond if rcond > 0 else np.inf
+        else:
+            # Without SciPy, the 1-norm condition number avoids the SVD
+            return np.linalg.cond(self.matrix, 1)
+
+
+class SparseFactorization(Factorization):
+
+    def __init__(self, SSff):
+        Factorization.__init__(self, SSff.tocsc())
+
+        # Factor the reduced stiffness matrix, preferring CHOLMOD from
+        # scikit-sparse since SSff is symmetric positive definite for any
+        # stable truss. It is imported here, since only this backend uses
+        # it and it is rarely installed.
+        try:
+            from sksparse.cholmod import cholesky as cholmod_cholesky
+            from sksparse.cholmod import CholmodNotPositiveDefiniteError
+        except ImportError:
+            cholmod_cholesky = None
+        if cholmod_cholesky is not None:
+            try:
+                self.solve = cholmod_cholesky(self.matrix)
+            except CholmodNotPositiveDefiniteError:
+                raise MechanismError(mode=self.mechanism())
+            self.fill = self.solve.L().nnz
+        else:
+            # SuperLU fails only on an exact zero pivot, so pivots that
+            # rounding has left of zero are looked for as in the dense
+            # check. Column j of U is column perm_c.argsort()[j] of K_ff.
+            try:
+                lu = scipy.sparse.linalg.splu(self.matrix)
+            except RuntimeError:
+                raise MechanismError(mode=self.mechanism())
+            column = abs(self.matrix).max(axis=0).toarray().ravel()
+            if np.any(~(np.abs(lu.U.diagonal()) > MECHANISM_TOLERANCE *
+                        column[np.argsort(lu.perm_c)])):
+                raise MechanismError(mode=self.mechanism())
+            self.solve = lu.solve
+            self.fill = lu.L.nnz + lu.U.nnz
+
+    def mechanism(self):
+        # A deflection that deforms no member, by inverse iteration with
+        # K_ff shifted just off singular. Every step shrinks the rest of
+        # the deflection by the shift over the next stiffness, so a few
+        # steps are enough.
+        shift = MECHANISM_TOLERANCE*np.max(np.abs(self.matrix.diagonal()))
+        lu = scipy.sparse.linalg.splu(
+            (self.matrix + shift*scipy.sparse.identity(
+                self.matrix.shape[0], format="csc")).tocsc())
+        mode = np.random.RandomState(0).rand(self.matrix.shape[0]) - 0.5
+        for step in range(3):
+            mode = lu.solve(mode)
+            mode /= np.max(np.abs(mode))
+        return mode
+
+    def calc_condition(self, mode):
+        if mode == "exact":
+            return np.linalg.cond(self.matrix.toarray())
+        else:
+            # Estimate the 1-norm condition number with the factorization
+            # we already have
+            inverse = scipy.sparse.linalg.LinearOperator(
+                self.matrix.shape, matvec=self.solve, rmatvec=self.solve,
+                dtype=self.matrix.dtype)
+            return scipy.sparse.linalg.onenormest(self.matrix) \
+                * scipy.sparse.linalg.onenormest(inverse)
+
+
+def name_joints(joints):
+    # "joint 3" or "joints 1, 2, 3", shortened for many joints
+    names = ", ".join(str(joint) for joint in joints[:10])
+    if len(joints) > 10:
+        names += ", ... (" + str(len(joints)) + " joints)"
+    return ("joints " if len(joints) > 1 else "joint ") + names
+
+
+class MechanismError(np.linalg.LinAlgError):
+    # The stiffness matrix is singular because the truss is a mechanism.
+    # joints are the joints that can move, if known, and mode a deflection,
+    # shape (3, n), that deforms no member. Only a failed factorization sets
+    # mode, in factorization order of the free DOFs until locate turns it
+    # into joint deflections. The checks of check_stability leave it None.
+
+    def __init__(self, message="The truss is a mechanism.", joints=None,
+                 mode=None):
+        np.linalg.LinAlgError.__init__(self, message)
+        self.joints = joints
+        self.mode = mode
+
+    def locate(self, ff, number_of_joints):
+        mode = np.zeros(3*number_of_joints)
+        mode[ff] = self.mode
+        self.mode = mode.reshape([number_of_joints, 3]).T
+        moving = np.abs(self.mode) > 1e-6*np.max(np.abs(self.mode))
+        self.joints = np.flatnonzero(np.any(moving, axis=0))
+        self.args = ("The truss is a mechanism: " + name_joints(self.joints) +
+                     " can move without deforming any member.",)
+
+
+class CholeskyFactorization(Factorization):
+
+    def __init__(self, SSff):
+        # SSff is the lower triangle of K_ff in LAPACK band storage, shape
+        # (bandwidth + 1, f), with K_ff[i, j] at SSff[i - j, j]. K_ff is
+        # symmetric positive definite for any stable truss, so its Cholesky
+        # factor takes half the work of LU, and the band of a well ordered
+        # truss much less work and memory than that.
+        Factorization.__init__(self, SSff)
+        self.fill = SSff.size
+        self.cholesky, info = scipy.linalg.lapack.dpbtrf(SSff, lower=1)
+
+        # A pivot that is not positive, or that rounding has left of a zero
+        # pivot, belongs to a DOF that the ones before it cannot hold
+        if info == 0:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                small = ~(self.cholesky[0, :]**2 >
+                          MECHANISM_TOLERANCE*SSff[0, :])
+            if np.any(small):
+                info = np.argmax(small) + 1
+        if info > 0:
+            raise MechanismError(mode=self.mechanism(info - 1))
+
+    def mechanism(self, k):
+        # The deflection that moves DOF k and deforms no member, from the
+        # Schur complement of the leading k DOFs, which are factored
+        mode = np.zeros(np.size(self.matrix, axis=1))
+        mode[k] = 1.0
+        if k > 0:
+            first = max(0, k - len(self.matrix) + 1)
+            coupling = np.zeros(k)
+            coupling[first:] = self.matrix[k - np.arange(first, k),
+                                           np.arange(first, k)]
+            mode[:k] = -scipy.linalg.lapack.dpbtrs(
+                self.cholesky[:, :k], coupling, lower=1)[0]
+        return mode
+
+    def solve(self, flat_loads):
+        solution, info = scipy.linalg.lapack.dpbtrs(self.cholesky,
+                                                    flat_loads, lower=1)
+        return solution
+
+    def one_norm(self):
+        # K_ff is symmetric, so every column adds the band below and to the
+        # right of its diagonal
+        if self.norm is None:
+            absolute = np.abs(self.matrix)
+            sums = absolute.sum(axis=0)
+            for d in range(1, len(absolute)):
+                sums[d:] += absolute[d, :-d]
+            self.norm = np.max(sums) if len(sums) else 0.0
+        return self.norm
+
+    def dot(self, flat_deflections):
+        deflections = flat_deflections.reshape([len(flat_deflections), -1])
+        result = self.matrix[0, :, None]*deflections
+        for d in range(1, len(self.matrix)):
+            result[d:] += self.matrix[d, :-d, None]*deflections[:-d]
+            result[:-d] += self.matrix[d, :-d, None]*deflections[d:]
+        return result.reshape(flat_deflections.shape)
+
+    def full_matrix(self):
+        number_of_free = np.size(self.matrix, axis=1)
+        matrix = np.zeros([number_of_free, number_of_free])
+        for d in range(len(self.matrix)):
+            diagonal = np.arange(number_of_free - d)
+            matrix[diagonal + d, diagonal] = self.matrix[d, :len(diagonal)]
+            matrix[diagonal, diagonal + d] = self.matrix[d, :len(diagonal)]
+        return matrix
+
+    def calc_condition(self, mode):
+        if mode == "exact":
+            return np.linalg.cond(self.full_matrix())
+        # Estimate the 1-norm condition number with the factorization we
+        # already have
+        shape = (np.size(self.matrix, axis=1),)*2
+        inverse = scipy.sparse.linalg.LinearOperator(
+            shape, matvec=self.solve, rmatvec=self.solve, dtype=float)
+        return self.one_norm()*scipy.sparse.linalg.onenormest(inverse)
+
+
+class BatchedFactorization(Factorization):
+
+    def __init__(self, SSff):
+        # A stack of k dense matrices, shape (k, f, f), solved together by
+        # np.linalg.solve, which factors them as it solves. Column i of the
+        # right-hand side belongs to matrix i, or to the only matrix of a
+        # stack of one.
+        Factorization.__init__(self, SSff)
+        self.fill = SSff.size
+
+    def solve(self, flat_loads):
+        single = len(self.matrix) == 1
+        rhs = flat_loads[None, :, :] if single else flat_loads.T[:, :, None]
+        try:
+            solution = np.linalg.solve(self.matrix, rhs)
+        except np.linalg.LinAlgError:
+            # Solve one by one, so that only the singular variants fail and
+            # get NaN results
+            solution = np.full(rhs.shape, np.nan)
+            for i in range(len(self.matrix)):
+                try:
+                    solution[i] = np.linalg.solve(self.matrix[i], rhs[i])
+                except np.linalg.LinAlgError:
+                    pass
+            if np.all(np.isnan(solution)):
+                raise np.linalg.LinAlgError("Singular matrix")
+        return solution[0] if single else solution[..., 0].T
+
+    def calc_condition(self, mode):
+        # The worst condition number of the stack
+        return np.max(np.linalg.cond(self.matrix,
+                                     None if mode == "exact" else 1))
+
+
+class UpdatedFactorization(Factorization):
+
+    def __init__(self, base, vectors, changes):
+        # The factorization of K + B*diag(changes)*B^T, from the
+        # factorization of K and the Woodbury identity. vectors (B) holds one
+        # column per changed member, its unit stiffness vector on the free
+        # DOFs, and changes the change of its EA/L. The updated matrix is
+        # only formed for an exact condition number.
+        Factorization.__init__(self, None)
+        self.fill = base.fill
+        self.base = base
+        self.vectors = vectors
+        self.changes = changes
+        self.shape = (len(vectors), len(vectors))
+
+        # K^-1*B and the small capacitance matrix I + diag(changes)*B^T*K^-1*B
+        self.inverse_vectors = base.solve(vectors)
+        capacitance = np.eye(len(changes)) \
+            + changes[:, None]*vectors.T.dot(self.inverse_vectors)
+        if np.linalg.cond(capacitance) > 1/UPDATE_TOLERANCE:
+            raise np.linalg.LinAlgError("Singular matrix")
+        self.capacitance = np.linalg.inv(capacitance)
+
+    def dot(self, flat_deflections):
+        return self.base.dot(flat_deflections) + self.vectors.dot(
+            self.changes[:, None]*self.vectors.T.dot(flat_deflections))
+
+    def solve(self, flat_loads):
+        deflections = self.base.solve(flat_loads)
+        correction = self.capacitance.dot(
+            self.changes[:, None]*self.vectors.T.dot(deflections))
+        return deflections - self.inverse_vectors.dot(correction)
+
+    def one_norm(self):
+        # An upper bound, from the 1-norm of K and of every member update
+        return self.base.one_norm() + np.sum(
+            np.abs(self.changes)*np.sum(np.abs(self.vectors), axis=0)**2)
+
+    def backward_error(self, flat_loads, flat_deflections):
+        # Normwise backward error of a solve, |F - K*U|/(|K|*|U| + |F|) in
+        # the 1-norm, to check the accuracy of the update
+        error = np.max(np.sum(np.abs(
+            flat_loads - self.dot(flat_deflections)), axis=0))
+        scale = self.one_norm() \
+            * np.max(np.sum(np.abs(flat_deflections), axis=0)) \
+            + np.max(np.sum(np.abs(flat_loads), axis=0))
+        return error/scale if scale > 0 else error
+
+    def calc_condition(self, mode):
+        if mode == "exact" or not HAS_SCIPY:
+            matrix = self.base.full_matrix() \
+                + (self.vectors*self.changes).dot(self.vectors.T)
+            return np.linalg.cond(matrix, None if mode == "exact" else 1)
+        # Estimate the 1-norm condition number with the updated solve
+        matrix = scipy.sparse.linalg.LinearOperator(
+            self.shape, matvec=self.dot, rmatvec=self.dot, dtype=float)
+        inverse = scipy.sparse.linalg.LinearOperator(
+            self.shape, matvec=self.solve, rmatvec=self.solve, dtype=float)
+        return scipy.sparse.linalg.onenormest(matrix) \
+            * scipy.sparse.linalg.onenormest(inverse)
+
+
+class IterativeSolver(Factorization):
+
+    def __init__(self, SSff, preconditioner="jacobi", tol=ITERATIVE_TOLERANCE,
+                 maxiter=None, guess=None):
+        # Preconditioned conjugate gradients on the sparse reduced stiffness
+        # matrix, which is symmetric positive definite for a stable truss.
+        # Nothing is factored but the preconditioner, so memory stays close
+        # to that of the matrix. Solves start from guess, and then from the
+        # last solution.
+        if preconditioner not in preconditioners:
+            raise ValueError(str(preconditioner)+' is not a defined '
+                             'preconditioner. Try ' +
+                             ', '.join(preconditioners[0:-1]) + ', or ' +
+                             preconditioners[-1] + '.')
+        Factorization.__init__(self, SSff.tocsr())
+        self.tol = tol
+        self.maxiter = maxiter if maxiter is not None \
+            else 10*self.matrix.shape[0]
+        self.guess = guess
+
+        # Convergence of the last solve, and the CG coefficients of its first
+        # load case for the condition estimate
+        self.iterations = 0
+        self.residual = 0.0
+        self.converged = True
+        self.coefficients = ([], [])
+
+        if preconditioner == "jacobi":
+            diagonal = self.matrix.diagonal()
+            if np.any(diagonal <= 0):
+                raise np.linalg.LinAlgError("Singular matrix")
+            inverse = 1/diagonal
+            self.precondition = lambda r: inverse[:, None]*r
+            self.fill = len(inverse)
+        elif preconditioner == "ic":
+            # SciPy has no incomplete Cholesky, so it is taken from a
+            # threshold ILU without pivoting: L*D*L^T with the L factor and
+            # the pivots. Unlike L*U, it is symmetric, as CG needs. The
+            # triangular factors are wrapped in SuperLU for fast solves.
+            options = {"permc_spec": "NATURAL", "diag_pivot_thresh": 0.0,
+                       "options": {"SymmetricMode": True}}
+            diagonal = scipy.sparse.diags(self.matrix.diagonal())
+            for shift in IC_SHIFTS:
+                ilu = scipy.sparse.linalg.spilu(
+                    (self.matrix + shift*diagonal).tocsc(),
+                    drop_tol=IC_DROP_TOLERANCE, fill_factor=IC_FILL_FACTOR,
+                    **options)
+                pivots = ilu.U.diagonal()
+                if np.all(pivots > 0):
+                    break
+            else:
+                raise np.linalg.LinAlgError("Singular matrix")
+            self.fill = ilu.L.nnz
+            lower = scipy.sparse.linalg.splu(ilu.L.tocsc(), **options)
+            upper = scipy.sparse.linalg.splu(ilu.L.T.tocsc(), **options)
+            self.precondition = \
+                lambda r: upper.solve(lower.solve(r)/pivots[:, None])
+        else:
+            # pyamg is imported here, since only this preconditioner uses
+            # it and it is slow to import
+            try:
+                import pyamg
+            except ImportError:
+                raise ImportError("The amg preconditioner requires pyamg.")
+            multigrid = pyamg.smoothed_aggregation_solver(self.matrix)\
+                .aspreconditioner(cycle="V")
+            self.precondition = multigrid.matmat
+
+    def solve(self, flat_loads):
+        flat_loads = np.asarray(flat_loads, dtype=float).reshape(
+            [self.matrix.shape[0], -1])
+        if self.guess is not None and self.guess.shape == flat_loads.shape:
+            x = self.guess.copy()
+        else:
+            x = np.zeros(flat_loads.shape)
+
+        # All load cases iterate together, each with its own step sizes,
+        # until every residual is below tol times its load
+        targets = self.tol*np.linalg.norm(flat_loads, axis=0)
+        r = flat_loads - self.matrix.dot(x)
+        z = self.precondition(r)
+        p = z.copy()
+        rz = np.sum(r*z, axis=0)
+        alphas, betas = [], []
+        residuals = np.linalg.norm(r, axis=0)
+        iteration = 0
+        while iteration < self.maxiter:
+            active = residuals > targets
+            if not np.any(active):
+                break
+            Ap = self.matrix.dot(p)
+            pAp = np.sum(p*Ap, axis=0)
+            if np.any(pAp[active] <= 0):
+                # Only a matrix that is not positive definite, such as that
+                # of a mechanism, has directions without stiffness
+                raise np.linalg.LinAlgError("Singular matrix")
+            alpha = np.where(active, rz/np.where(active, pAp, 1.0), 0.0)
+            x += alpha*p
+            r -= alpha*Ap
+            z = self.precondition(r)
+            rz_next = np.sum(r*z, axis=0)
+            beta = np.where(active, rz_next/np.where(active, rz, 1.0), 0.0)
+            p = z + beta*p
+            rz = rz_next
+            residuals = np.linalg.norm(r, axis=0)
+            if active[0]:
+                alphas.append(alpha[0])
+                betas.append(beta[0])
+            iteration += 1
+
+        self.iterations = iteration
+        scale = np.where(targets > 0, targets/self.tol, 1.0)
+        self.residual = float(np.max(residuals/scale)) \
+            if len(residuals) > 0 else 0.0
+        self.converged = bool(np.all(residuals <= targets))
+        self.coefficients = (alphas, betas)
+        self.conditions.pop("estimate", None)
+        self.guess = x
+        if not self.converged:
+            warnings.warn("The iterative solver did not converge in " +
+                          str(iteration) + " iterations. The relative "
+                          "residual is " + str(self.residual) +
+                          ". Results may be inaccurate.")
+        return x
+
+    def calc_condition(self, mode):
+        if mode == "exact":
+            return np.linalg.cond(self.matrix.toarray())
+
+        # The extreme eigenvalues of the Lanczos matrix that CG builds give
+        # the condition number of the preconditioned matrix, which is what
+        # limits the iteration, at no extra cost
+        alphas, betas = self.coefficients
+        if len(alphas) == 0:
+            return 1.0
+        alphas = np.array(alphas)
+        betas = np.array(betas)
+        diagonal = 1/alphas
+        diagonal[1:] += betas[:-1]/alphas[:-1]
+        off_diagonal = np.sqrt(betas[:-1])/alphas[:-1]
+        k = len(diagonal)
+        smallest, largest = [scipy.linalg.eigvalsh_tridiagonal(
+            diagonal, off_diagonal, select='i', select_range=(i, i))[0]
+            for i in [0, k - 1]]
+        return largest/smallest if smallest > 0 else np.inf
+
+
+def member_vectors(directions, connections, members, number_of_dofs):
+    # Unit stiffness vectors of some members over all DOFs, one column per
+    # member: the member stiffness matrix is EA/L times b*b^T
+    vectors = np.zeros([number_of_dofs, len(members)])
+    columns = np.arange(len(members))
+    for axis in range(3):
+        vectors[3*connections[0, members] + axis, columns] = \
+            -directions[axis, members]
+        vectors[3*connections[1, members] + axis, columns] = \
+            directions[axis, members]
+    return vectors
+
+
+def nodal_forces(forces, directions, connections, dofs, number_of_dofs):
+    # The forces members exert on some DOFs, one column per row of forces,
+    # which is K*U on those DOFs
+    position = np.full(number_of_dofs, -1)
+    position[dofs] = np.arange(len(dofs))
+    rows = position[np.hstack((3*connections[0, :, None] + np.arange(3),
+                               3*connections[1, :, None] + np.arange(3)))]
+    cols = np.broadcast_to(np.arange(len(rows))[:, None], rows.shape)
+    values = np.hstack((-directions.T, directions.T))
+    keep = rows >= 0
+    shape = (len(dofs), len(rows))
+    if HAS_SCIPY:
+        incidence = scipy.sparse.csr_matrix(
+            (values[keep], (rows[keep], cols[keep])), shape=shape)
+    else:
+        incidence = np.zeros(shape)
+        np.add.at(incidence, (rows[keep], cols[keep]), values[keep])
+    return incidence.dot(np.atleast_2d(forces).T)
+
+
+# abc.ABC is not in Python 2.7
+class Backend(abc.ABCMeta("ABC", (object,), {})):
+    # A solver backend takes a truss from its stiffness matrix to member
+    # forces in four steps, assemble, factor, solve and post_process, so
+    # that any backend can stand in for another and their results can be
+    # compared. Subclasses set the flags below and provide factor.
+
+    # K_ff is assembled as a sparse matrix
+    sparse = False
+
+    # The free DOFs are numbered in bandwidth reducing order
+    reorder = False
+
+    # Cached factorizations take low-rank updates when a few members change
+    updatable = True
+
+    # Solves start from the deflections of the last solve
+    warm_start = False
+
+    # The backend needs SciPy
+    requires_scipy = False
+
+    # Trusses are checked for mechanisms before they are assembled
+    precheck = True
+
+    def assemble(self, truss_info, partition):
+        # K_ff, K_fr and tj, the member stiffnesses EA/L times their
+        # directions
+        ff, rr = partition
+        dof, tj = assemble_stiffness(truss_info, sparse=self.sparse)
+        SSff, SSfr, SSrr = reduce_stiffness(dof, ff, rr)
+        return SSff, SSfr, tj
+
+    @abc.abstractmethod
+    def factor(self, SSff, **options):
+        # A Factorization of K_ff
+        pass
+
+    def solve(self, factorization, flat_loads):
+        return factorization.solve(flat_loads)
+
+    def post_process(self, truss_info, partition, tj, SSfr, flat_loads,
+                     flat_deflections):
+        # Member forces, deflections and reactions of every load case, shape
+        # (k, m), (k, 3, n) and (k, 3, n), from the free DOF deflections
+        ff, rr = partition
+        connections = truss_info["connections"]
+        number_of_joints = np.size(truss_info["reactions"], axis=1)
+        number_of_cases = np.size(flat_loads, axis=1)
+
+        deflections = np.zeros([3*number_of_joints, number_of_cases])
+        deflections[ff, :] = flat_deflections
+        deflections = deflections.T\
+            .reshape([number_of_cases, number_of_joints, 3]).transpose(0, 2, 1)
+        forces = np.sum(np.multiply(
+            tj, deflections[:, :, connections[1, :]] -
+            deflections[:, :, connections[0, :]]), axis=1)
+
+        # Compute the reactions
+        # Important bugfix added: R=KU-F, this means nodal loads must be
+        # subtracted from reactions. This bug already exists at the original
+        # matlab script. Please see comment from Chris Jobes at
+        # https://de.mathworks.com/matlabcentral/fileexchange/14313-truss-analysis
+        # Supports do not move, so only K_rf = K_fr^T contributes to K*U.
+        # Without K_fr, K*U is summed from the member forces.
+        reactions = np.zeros([3*number_of_joints, number_of_cases])
+        if SSfr is not None:
+            reactions[rr, :] = SSfr.T.dot(flat_deflections)
+        else:
+            directions, lengths = member_geometry(truss_info)
+            reactions[rr, :] = nodal_forces(forces, directions, connections,
+                                            rr, 3*number_of_joints)
+        reactions[rr, :] -= flat_loads[rr, :]
+        reactions = reactions.T\
+            .reshape([number_of_cases, number_of_joints, 3]).transpose(0, 2, 1)
+        return forces, deflections, reactions
+
+
+class DenseBackend(Backend):
+    # LU factorization by LAPACK
+
+    def factor(self, SSff, **options):
+        return DenseFactorization(SSff)
+
+
+class CholeskyBackend(Backend):
+    # Banded Cholesky factorization by LAPACK, of the lower triangle of K_ff
+    # in the bandwidth reducing order of the free DOFs
+    reorder = True
+    requires_scipy = True
+
+    def assemble(self, truss_info, partition):
+        # Only the entries of the member blocks on or below the diagonal of
+        # K_ff are summed, straight into band storage. Reactions are summed
+        # from the member forces instead of K_fr.
+        ff, rr = partition
+        connections = truss_info["connections"]
+        directions, lengths = member_geometry(truss_info)
+        ea_over_l = truss_info["elastic_modulus"]*truss_info["area"]/lengths
+
+        d2 = directions.T[:, :, None]*directions.T[:, None, :]
+        ss = ea_over_l[:, None, None]*np.concatenate(
+            (np.concatenate((d2, -d2), axis=2),
+             np.concatenate((-d2, d2), axis=2)), axis=1)
+
+        position = np.full(3*np.size(truss_info["coordinates"], axis=1), -1)
+        position[ff] = np.arange(len(ff))
+        e = position[np.hstack((3*connections[0, :, None] + np.arange(3),
+                                3*connections[1, :, None] + np.arange(3)))]
+        rows = np.broadcast_to(e[:, :, None], ss.shape)
+        cols = np.broadcast_to(e[:, None, :], ss.shape)
+        lower = (cols >= 0) & (rows >= cols)
+        offsets = (rows - cols)[lower]
+        bandwidth = np.max(offsets) if len(offsets) else 0
+        SSff = np.bincount(offsets*len(ff) + cols[lower], weights=ss[lower],
+                           minlength=(bandwidth + 1)*len(ff))\
+            .reshape([bandwidth + 1, len(ff)])
+        return SSff, None, ea_over_l*directions
+
+    def factor(self, SSff, **options):
+        return CholeskyFactorization(SSff)
+
+
+class SparseBackend(Backend):
+    # Sparse direct factorization, by CHOLMOD or SuperLU
+    sparse = True
+    reorder = True
+    requires_scipy = True
+
+    def factor(self, SSff, **options):
+        return SparseFactorization(SSff)
+
+
+class IterativeBackend(Backend):
+    # Preconditioned conjugate gradients, with options such as
+    # preconditioner, tol and maxiter
+    sparse = True
+    reorder = True
+    updatable = False
+    warm_start = True
+    requires_scipy = True
+
+    def factor(self, SSff, **options):
+        return IterativeSolver(SSff, **options)
+
+
+class BatchedBackend(Backend):
+    # k variants of one truss, which differ in area and elastic modulus,
+    # shape (k, m), and have one load case each, solved as a stack of dense
+    # matrices. A single truss is a stack of one, which may have any number
+    # of load cases. Variants that are mechanisms get NaN results, so they
+    # are not checked beforehand.
+    updatable = False
+    precheck = False
+
+    def assemble(self, truss_info, partition):
+        # K_ff of every variant is a sum of the same unit member blocks,
+        # weighted by EA/L, so the reduced pattern is built once. Reactions
+        # are summed from the member forces instead of a stack of K_fr.
+        ff, rr = partition
+        pattern, directions, lengths = stiffness_pattern(truss_info, ff)
+        ea_over_l = truss_info["elastic_modulus"] \
+            * np.atleast_2d(truss_info["area"])/lengths
+        SSff = pattern.T.dot(ea_over_l.T).T.reshape([-1, len(ff), len(ff)])
+        return SSff, None, ea_over_l[:, None, :]*directions
+
+    def factor(self, SSff, **options):
+        return BatchedFactorization(SSff)
+
+
+def register_backend(name, backend):
+    # Make a Backend available to the_forces, and so to calc_fos, as
+    # solver=name
+    backends[name] = backend
+    if name not in solvers:
+        solvers.append(name)
+
+
+register_backend("dense", DenseBackend())
+register_backend("sparse", SparseBackend())
+register_backend("iterative", IterativeBackend())
+register_backend("cholesky", CholeskyBackend())
+register_backend("batched", BatchedBackend())
+
+
+def factorize(SSff, solver="dense", **options):
+    # options are passed on to the backend, and used by the iterative one
+    return backends[solver].factor(SSff, **options)
+
+
+def partition_dofs(reactions):
+    # Index arrays of the free and the restrained DOFs, in global DOF order
+    # (3*joint + axis). These only depend on the support layout.
+    restrained = reactions.T.ravel() != 0
+    return np.flatnonzero(~restrained), np.flatnonzero(restrained)
+
+
+def gather_pebble(pebbles, held, joint, keep=None):
+    # Move a free pebble of the pebble game to joint, along the members the
+    # joints hold, without taking one from keep. Returns False if there is
+    # none to move.
+    path = {joint: None, keep: None}
+    stack = [joint]
+    while stack:
+        current = stack.pop()
+        if current != joint and pebbles[current] > 0:
+            pebbles[current] -= 1
+            pebbles[joint] += 1
+            while path[current] is not None:
+                previous = path[current]
+                held[previous].remove(current)
+                held[current].append(previous)
+                current = previous
+            return True
+        for other in held[current]:
+            if other not in path:
+                path[other] = current
+                stack.append(other)
+    return False
+
+
+def floppy_joints(connections, restrained, number_of_joints):
+    # The joints of a planar truss that can move for any generic position
+    # of the joints, by the pebble game of slider-pinning rigidity. Every
+    # joint starts with two pebbles. A member is independent if four
+    # pebbles can be gathered on its ends, and then held by one of them,
+    # and a restrained axis if one can be gathered on its joint, which it
+    # takes for good. Joints that can still reach a pebble at the end can
+    # move.
+    pebbles = np.full(number_of_joints, 2)
+    held = [[] for joint in range(number_of_joints)]
+    for start, end in connections.T:
+        if start == end:
+            continue
+        while pebbles[start] < 2 and \
+                gather_pebble(pebbles, held, start, keep=end):
+            pass
+        while pebbles[end] < 2 and \
+                gather_pebble(pebbles, held, end, keep=start):
+            pass
+        if pebbles[start] + pebbles[end] == 4:
+            pebbles[start] -= 1
+            held[start].append(end)
+    for axis, joint in zip(*np.nonzero(restrained[0:2, :])):
+        if pebbles[joint] > 0 or gather_pebble(pebbles, held, joint):
+            pebbles[joint] -= 1
+
+    # Joints that reach a free pebble through the members they hold
+    holders = [[] for joint in range(number_of_joints)]
+    for joint in range(number_of_joints):
+        for other in held[joint]:
+            holders[other].append(joint)
+    floppy = np.flatnonzero(pebbles > 0).tolist()
+    reached = set(floppy)
+    while floppy:
+        for other in holders[floppy.pop()]:
+            if other not in reached:
+                reached.add(other)
+                floppy.append(other)
+    return np.array(sorted(reached), dtype=int)
+
+
+def check_stability(truss_info, partition=None, rigidity=False):
+    # Quick checks, without a factorization, that a truss is not a
+    # mechanism. Raises a MechanismError, naming the joints that can move,
+    # when a joint is not held along each of its free axes, when the
+    # supports cannot hold the truss as a rigid body, or when there are
+    # fewer members than free DOFs (Maxwell's count). With rigidity, planar
+    # trusses, restrained in z at every joint, are checked for generic
+    # rigidity as well. Mechanisms that come from the positions of the
+    # joints alone, such as collinear members, are left to the
+    # factorization.
+    number_of_joints = np.size(truss_info["coordinates"], axis=1)
+    if number_of_joints == 0:
+        return
+    if partition is None:
+        partition = partition_dofs(truss_info["reactions"])
+    ff, rr = partition
+    restrained = truss_info["reactions"] != 0
+    planar = bool(np.all(restrained[2, :]))
+
+    # Members without stiffness do not hold anything
+    directions, lengths = member_geometry(truss_info)
+    stiff = (truss_info["elastic_modulus"]*truss_info["area"] != 0) & \
+        (lengths > 0)
+    connections = truss_info["connections"][:, stiff]
+    directions = directions[:, stiff]
+
+    # The unit stiffness block of every joint on its free axes is singular
+    # if the joint can move alone
+    d2 = directions.T[:, :, None]*directions.T[:, None, :]
+    blocks = np.zeros([number_of_joints, 3, 3])
+    np.add.at(blocks, connections[0, :], d2)
+    np.add.at(blocks, connections[1, :], d2)
+    free = ~restrained.T
+    blocks *= free[:, :, None] & free[:, None, :]
+    blocks[:, np.arange(3), np.arange(3)] += restrained.T
+    loose = np.flatnonzero(np.linalg.eigvalsh(blocks)[:, 0] <
+                           MECHANISM_TOLERANCE)
+    if len(loose) > 0:
+        raise MechanismError("The truss is a mechanism: " +
+                             name_joints(loose) +
+                             " can move without deforming any member.",
+                             joints=loose)
+
+    # The supports must hold every rigid body motion of the joints, in the
+    # plane or in space, u = t + w x r, with r from the centroid
+    r = truss_info["coordinates"] - \
+        np.mean(truss_info["coordinates"], axis=1)[:, None]
+    r /= max(np.max(np.abs(r)), np.finfo(float).tiny)
+    one, zero = np.ones(number_of_joints), np.zeros(number_of_joints)
+    if planar:
+        motions = np.array([[one, zero, -r[1]],
+                            [zero, one, r[0]]])
+    else:
+        motions = np.array([[one, zero, zero, zero, r[2], -r[1]],
+                            [zero, one, zero, -r[2], zero, r[0]],
+                            [zero, zero, one, r[1], -r[0], zero]])
+    motions = motions.transpose(0, 2, 1)
+    possible = np.linalg.matrix_rank(
+        motions.reshape([-1, np.size(motions, axis=2)]))
+    held = np.linalg.matrix_rank(motions[restrained[0:len(motions), :]]) \
+        if np.any(restrained[0:len(motions), :]) else 0
+    if held < possible:
+        raise MechanismError("The truss is a mechanism: its supports hold "
+                             "only " + str(held) + " of its " +
+                             str(possible) + " rigid body motions" +
+                             (" in the plane." if planar else "."),
+                             joints=np.arange(number_of_joints))
+
+    # Every free DOF needs a member, and in the plane, the pebble game
+    # finds where the members are missing
+    if np.size(connections, axis=1) < len(ff) or (rigidity and planar):
+        if planar:
+            floppy = floppy_joints(connections, restrained, number_of_joints)
+            if len(floppy) > 0:
+                raise MechanismError("The truss is a mechanism: " +
+                                     name_joints(floppy) + " can move "
+                                     "without deforming any member.",
+                                     joints=floppy)
+        else:
+            # Rigidity in space has no counting rule, so name the joints
+            # that hold fewer members than free DOFs, with every member
+            # shared between its free ends. The count guarantees there is
+            # one.
+            dofs = np.sum(~restrained, axis=0)
+            shares = np.where(dofs[connections[::-1, :]] > 0, 0.5, 1.0)
+            counts = np.bincount(connections.ravel(), weights=shares.ravel(),
+                                 minlength=number_of_joints)
+            weak = np.flatnonzero(counts < dofs)
+            raise MechanismError("The truss is a mechanism: it has " +
+                                 str(np.size(connections, axis=1)) +
+                                 " members for " + str(len(ff)) +
+                                 " free degrees of freedom, too few at " +
+                                 name_joints(weak) + ".", joints=weak)
+
+
+def envelope(connections, ff, number_of_joints):
+    # Bandwidth and profile (the entries between the first nonzero of each
+    # row and the diagonal) of K_ff with the free DOFs in the order of ff
+    position = np.full(3*number_of_joints, -1)
+    position[ff] = np.arange(len(ff))
+    ends = np.hstack((3*connections[0, :, None] + np.arange(3),
+                      3*connections[1, :, None] + np.arange(3)))
+    ends = position[ends]
+    rows = np.broadcast_to(ends[:, :, None], ends.shape + (6,)).ravel()
+    cols = np.broadcast_to(ends[:, None, :], ends.shape + (6,)).ravel()
+    keep = (rows >= 0) & (cols >= 0)
+    rows, cols = rows[keep], cols[keep]
+    first = np.arange(len(ff))
+    np.minimum.at(first, rows, cols)
+    bandwidth = int(np.max(np.abs(rows - cols))) if len(rows) else 0
+    return bandwidth, int(np.sum(np.arange(len(ff)) - first))
+
+
+def factor_fill(connections, ff, number_of_joints):
+    # Entries of the Cholesky factor of K_ff, on and below the diagonal,
+    # with the free DOFs in the order of ff, counted without factoring. The
+    # DOFs of a joint stay together in every order used here, so this
+    # counts the columns of the factor of the joint graph, weighted by the
+    # free DOFs of each joint, from its elimination tree (Gilbert, Ng and
+    # Peyton), in time close to the number of members.
+    joints, first = np.unique(ff // 3, return_index=True)
+    joints = joints[np.argsort(first)]
+    n = len(joints)
+    rank = np.full(number_of_joints, -1)
+    rank[joints] = np.arange(n)
+    weight = np.bincount(rank[ff // 3], minlength=n).tolist()
+    ends = rank[connections]
+    ends = ends[:, np.all(ends >= 0, axis=0) & (ends[0, :] != ends[1, :])]
+    low, high = np.min(ends, axis=0).tolist(), np.max(ends, axis=0).tolist()
+    above = [[] for j in range(n)]
+    below = [[] for j in range(n)]
+    for i, j in zip(low, high):
+        above[i].append(j)
+        below[j].append(i)
+
+    # Elimination tree, with path compression
+    parent = [-1]*n
+    ancestor = [-1]*n
+    for k in range(n):
+        for i in below[k]:
+            while i != -1 and i < k:
+                following = ancestor[i]
+                ancestor[i] = k
+                if following == -1:
+                    parent[i] = k
+                i = following
+
+    # Postorder of the tree
+    children = [[] for j in range(n)]
+    for j in range(n - 1, -1, -1):
+        if parent[j] != -1:
+            children[parent[j]].append(j)
+    post = []
+    for root in range(n):
+        if parent[root] != -1:
+            continue
+        stack = [root]
+        while stack:
+            j = stack[-1]
+            if children[j]:
+                stack.append(children[j].pop())
+            else:
+                post.append(stack.pop())
+
+    # Every row adds its weight to the columns on the paths from its
+    # leaves up to it, once where paths overlap
+    first = [-1]*n
+    delta = [0]*n
+    for k, j in enumerate(post):
+        delta[j] = weight[j] if first[j] == -1 else 0
+        while j != -1 and first[j] == -1:
+            first[j] = k
+            j = parent[j]
+    max_first = [-1]*n
+    previous_leaf = [-1]*n
+    ancestor = list(range(n))
+    for j in post:
+        if parent[j] != -1:
+            delta[parent[j]] -= weight[j]
+        for i in above[j]:
+            if first[j] <= max_first[i]:
+                continue
+            max_first[i] = first[j]
+            leaf = previous_leaf[i]
+            previous_leaf[i] = j
+            delta[j] += weight[i]
+            if leaf != -1:
+                q = leaf
+                while q != ancestor[q]:
+                    q = ancestor[q]
+                while leaf != q:
+                    ancestor[leaf], leaf = q, ancestor[leaf]
+                delta[q] -= weight[i]
+        if parent[j] != -1:
+            ancestor[j] = parent[j]
+    counts = delta
+    for j in post:
+        if parent[j] != -1:
+            counts[parent[j]] += counts[j]
+    weight = np.array(weight)
+    return int(np.sum(weight*(weight + 1)//2 +
+                      weight*(np.array(counts) - weight)))
+
+
+def order_dofs(connections, ff, number_of_joints):
+    # The free DOFs in reverse Cuthill-McKee order of the joints, which
+    # keeps the nonzeros of K_ff in a narrow band whatever the joint order
+    # of the input. The DOFs of a joint stay together. Also returns the
+    # method used, the ordering time, and the bandwidth and profile before
+    # and after.
+    start = time.perf_counter()
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(np.size(connections, axis=1)),
+         (connections[0, :], connections[1, :])),
+        shape=(number_of_joints, number_of_joints)).tocsr()
+    joint_order = reverse_cuthill_mckee(graph + graph.T,
+                                        symmetric_mode=True)
+    rank = np.empty(number_of_joints, dtype=int)
+    rank[joint_order] = np.arange(number_of_joints)
+    ordered = ff[np.lexsort((ff % 3, rank[ff // 3]))]
+    elapsed = time.perf_counter() - start
+
+    # Joints that are already listed in a good order, such as a structured
+    # grid, are kept in that order
+    bandwidth_before, profile_before = envelope(connections, ff,
+                                                number_of_joints)
+    bandwidth_after, profile_after = envelope(connections, ordered,
+                                              number_of_joints)
+    method = "rcm"
+    if profile_after >= profile_before:
+        ordered, method = ff, "none"
+        bandwidth_after, profile_after = bandwidth_before, profile_before
+    return ordered, {"method": method,
+                     "time": elapsed,
+                     "bandwidth_before": bandwidth_before,
+                     "bandwidth_after": bandwidth_after,
+                     "profile_before": profile_before,
+                     "profile_after": profile_after}
+
+
+def ordering_fill(ordering):
+    # Fill of the Cholesky factor of K_ff in the given and in the chosen
+    # order of the free DOFs, and how many times smaller it is after. They
+    # are counted when first asked for, since that takes longer than the
+    # ordering itself, and kept in its stats.
+    stats = ordering["stats"]
+    if "fill_before" not in stats:
+        stats["fill_before"] = factor_fill(ordering["connections"],
+                                           ordering["given"],
+                                           ordering["number_of_joints"])
+        stats["fill_after"] = factor_fill(ordering["connections"],
+                                          ordering["free"],
+                                          ordering["number_of_joints"])
+        stats["fill_reduction"] = stats["fill_before"] / \
+            max(stats["fill_after"], 1)
+    return stats
+
+
+def reset_cache(cache):
+    # Drop the factorization, but keep the DOF ordering, which only depends
+    # on the topology
+    ordering = cache.get("ordering")
+    cache.clear()
+    if ordering is not None:
+        cache["ordering"] = ordering
+
+
+def reduce_stiffness(dof, ff, rr):
+    # Split the global stiffness matrix into the free/restrained blocks
+    # K_ff, K_fr and K_rr with fancy indexing
+    if HAS_SCIPY and scipy.sparse.issparse(dof):
+        dof_f = dof[ff, :]
+        dof_r = dof[rr, :]
+        return dof_f[:, ff], dof_f[:, rr], dof_r[:, rr]
+    else:
+        return dof[np.ix_(ff, ff)], dof[np.ix_(ff, rr)], dof[np.ix_(rr, rr)]
+
+
+def fingerprint(*arrays):
+    # Hash of the shape, type and contents of some arrays
+    h = hashlib.sha1()
+    for value in arrays:
+        value = np.ascontiguousarray(value)
+        h.update(str((value.shape, value.dtype.str)).encode())
+        h.update(value.tobytes())
+    return h.hexdigest()
+
+
+def stiffness_fingerprint(truss_info, solver):
+    # Hash of everything the reduced stiffness matrix depends on
+    return solver + fingerprint(*[truss_info[key] for key in
+                                  ["coordinates", "connections",
+                                   "elastic_modulus", "area", "reactions"]])
+
+
+def topology_fingerprint(truss_info, solver):
+    # Hash of everything but the member stiffnesses, which low-rank updates
+    # of a cached factorization can change
+    return solver + fingerprint(*[truss_info[key] for key in
+                                  ["coordinates", "connections",
+                                   "reactions"]])
+
+
+def cached_factorization(truss_info, solver, partition, cache=None,
+                         max_updates=MAX_UPDATES, options=None, precheck=True):
+    # tj, K_fr and the factorization of K_ff. A cache dict keeps them between
+    # calls. They are reused as long as geometry, sections, supports and
+    # solver options are unchanged, so a load-only change costs one
+    # triangular solve. When only the EA of a few members has changed since
+    # the last factorization, it is updated instead, as long as at most
+    # max_updates members differ. Backends that cannot be updated, like the
+    # iterative one, may start from the last deflections instead. precheck
+    # False skips the mechanism check of check_stability, for callers that
+    # have already run it.
+    backend = backends[solver]
+    ff, rr = partition
+    options = options or {}
+    fingerprint = topology = None
+    if cache is not None:
+        solver_key = solver + repr(sorted(options.items()))
+        fingerprint = stiffness_fingerprint(truss_info, solver_key)
+        if cache.get("fingerprint") == fingerprint:
+            return cache["tj"], cache["SSfr"], cache["factorization"]
+        topology = topology_fingerprint(truss_info, solver_key)
+
+    directions, lengths = member_geometry(truss_info)
+    ea_over_l = truss_info["elastic_modulus"]*truss_info["area"]/lengths
+    if topology is not None and cache.get("topology") == topology and \
+            backend.updatable:
+        changed = np.flatnonzero(ea_over_l != cache["ea_over_l"])
+        if len(changed) <= max_updates:
+            vectors = member_vectors(
+                directions, truss_info["connections"], changed,
+                3*np.size(truss_info["coordinates"], axis=1))
+            changes = ea_over_l[changed] - cache["ea_over_l"][changed]
+            try:
+                factorization = UpdatedFactorization(
+                    cache["base"], vectors[ff, :], changes)
+            except np.linalg.LinAlgError:
+                # A nearly singular update, such as a member with no area,
+                # is refactored, which also reports a mechanism
+                pass
+            else:
+                # K_rf changes with the same vectors
+                if cache["base_SSfr"] is None:
+                    SSfr = None
+                elif HAS_SCIPY and scipy.sparse.issparse(cache["base_SSfr"]):
+                    SSfr = cache["base_SSfr"] + scipy.sparse.csr_matrix(
+                        vectors[ff, :]*changes).dot(
+                        scipy.sparse.csr_matrix(vectors[rr, :]).T)
+                else:
+                    SSfr = cache["base_SSfr"] \
+                        + (vectors[ff, :]*changes).dot(vectors[rr, :].T)
+                tj = ea_over_l*directions
+                cache.update({"fingerprint": fingerprint,
+                              "tj": tj,
+                              "SSfr": SSfr,
+                              "factorization": factorization})
+                return tj, SSfr, factorization
+
+    # A quick look for mechanisms before the work of a factorization
+    if backend.precheck and precheck:
+        check_stability(truss_info, partition)
+
+    # Build the stiffness matrix of the free DOFs
+    SSff, SSfr, tj = backend.assemble(truss_info, partition)
+
+    # Factor the free DOFs once, then solve all load cases and estimate the
+    # condition number with the same factorization
+    if backend.warm_start and topology is not None and \
+            cache.get("topology") == topology:
+        options = dict(options, guess=cache["factorization"].guess)
+    try:
+        factorization = backend.factor(SSff, **options)
+    except MechanismError as error:
+        error.locate(ff, np.size(truss_info["coordinates"], axis=1))
+        raise
+    if cache is not None:
+        reset_cache(cache)
+        cache.update({"fingerprint": fingerprint,
+                      "topology": topology,
+                      "ea_over_l": ea_over_l,
+                      "base": factorization,
+                      "base_SSfr": SSfr,
+                      "tj": tj,
+                      "SSfr": SSfr,
+                      "factorization": factorization})
+    return tj, SSfr, factorization
+
+
+def self_weight(connections, mass, g, number_of_joints):
+    # Half of every member weight goes to each of its end joints. Both ends
+    # are interleaved so every joint sums its members in member order. mass
+    # may be (k, m) for k variants, which gives (k, 3, n) weights.
+    mass = np.asarray(mass, dtype=float)
+    weights = np.zeros(mass.shape[:-1] + (3, number_of_joints))
+    half_weights = np.asarray(g, dtype=float)[:, None] \
+        * (mass[..., None, :]/2.0)
+    np.add.at(weights, (Ellipsis, connections.ravel()),
+              np.repeat(half_weights, 2, axis=-1))
+    return weights
+
+
+def the_forces(truss_info, solver="dense", partition=None,
+               condition="estimate", cache=None, max_updates=MAX_UPDATES,
+               precheck=True, **options):
+    # solver is the name of a registered backend, or "auto". options, such
+    # as preconditioner, tol and maxiter, are passed on to the backend.
+    # precheck False skips the check for mechanisms before the solve.
+    if solver not in solvers:
+        raise ValueError(solver+' is not a defined solver. Try ' +
+                         ', '.join(solvers[0:-1]) + ', or ' +
+                         solvers[-1] + '.')
+    if condition not in conditions:
+        raise ValueError(condition+' is not a defined condition mode. Try ' +
+                         ', '.join(conditions[0:-1]) + ', or ' +
+                         conditions[-1] + '.')
+    number_of_joints = np.size(truss_info["reactions"], axis=1)
 
     # This identifies joints that can be loaded
-    ff = np.where(deflections.T.flat == 1)[0]
-
-    # Build the global stiffness matrix
-    for i in range(np.size(truss_info["connections"], axis=1)):
-        ends = truss_info["connections"][:, i]
-        length_vector = truss_info["coordinates"][:, ends[1]] \
-            - truss_info["coordinates"][:, ends[0]]
-        length = np.linalg.norm(length_vector)
-        direction = length_vector/length
-        d2 = np.outer(direction, direction)
-        ea_over_l = truss_info["elastic_modulus"][i]*truss_info["area"][i]\
-            / length
-        ss = ea_over_l*np.concatenate((np.concatenate((d2, -d2), axis=1),
-                                       np.concatenate((-d2, d2), axis=1)),
-                                       axis=0)
-        tj[:, i] = ea_over_l*direction
-        e = list(range((3*ends[0]), (3*ends[0] + 3))) \
-            + list(range((3*ends[1]), (3*ends[1] + 3)))
-        for ii in range(6):
-            for j in range(6):
-                dof[e[ii], e[j]] += ss[ii, j]
-
-    SSff = np.zeros([len(ff), len(ff)])
-    for i in range(len(ff)):
-        for j in range(len(ff)):
-            SSff[i, j] = dof[ff[i], ff[j]]
-
-    flat_loads = truss_info["loads"].T.flat[ff]
-    flat_deflections = np.linalg.solve(SSff, flat_loads)
-
-    ff = np.where(deflections.T == 1)
-    for i in range(len(ff[0])):
-        deflections[ff[1][i], ff[0][i]] = flat_deflections[i]
-    forces = np.sum(np.multiply(
-        tj, deflections[:, truss_info["connections"][1, :]] -
-        deflections[:, truss_info["connections"][0, :]]), axis=0)
-
-    # Check the condition number, and warn the user if it is out of range
-    cond = np.linalg.cond(SSff)
-
-    # Compute the reactions
-    # Important bugfix added: R=KU-F, this means nodal loads must be subtracted
-    # from reactions. This bug already exists at the original matlab script.
-    # Please see comment from Chris Jobes at
-    # https://de.mathworks.com/matlabcentral/fileexchange/14313-truss-analysis
-    reactions = np.sum(dof*deflections.T.flat[:], axis=1)\
-        .reshape([w[1], w[0]]).T - truss_info["loads"]
-
-    return forces, deflections, reactions, cond
+    if partition is None:
+        partition = partition_dofs(truss_info["reactions"])
+    ff, rr = partition
+
+    # Loads are either one 3 x n array or a stack of k load cases. Each case
+    # becomes one column of the right-hand side.
+    loads = np.asarray(truss_info["loads"], dtype=float)
+    single_case = loads.ndim == 2
+    loads = loads.reshape([-1, 3, number_of_joints])
+    number_of_cases = np.size(loads, axis=0)
+    flat_loads = loads.transpose(0, 2, 1)\
+        .reshape([number_of_cases, 3*number_of_joints]).T
+
+    if solver == "auto":
+        solver = pick_solver(3*number_of_joints, stiffness_density(
+            number_of_joints, np.size(truss_info["connections"], axis=1)),
+            number_of_cases)
+    backend = backends[solver]
+    if backend.requires_scipy and not HAS_SCIPY:
+        raise ImportError("The " + solver + " solver requires scipy.")
+
+    # Some backends number the free DOFs in bandwidth reducing order. The
+    # order is cached per topology, and results are scattered back by DOF
+    # index, so they keep the joint order.
+    if backend.reorder:
+        key = fingerprint(truss_info["connections"], truss_info["reactions"])
+        ordering = cache.get("ordering") if cache is not None else None
+        if ordering is None or ordering["key"] != key:
+            ordered, stats = order_dofs(truss_info["connections"], ff,
+                                        number_of_joints)
+            ordering = {"key": key, "free": ordered, "given": ff,
+                        "connections": truss_info["connections"],
+                        "number_of_joints": number_of_joints,
+                        "stats": stats}
+            if cache is not None:
+                cache["ordering"] = ordering
+        ff = ordering["free"]
+        partition = (ff, rr)
+
+    tj, SSfr, factorization = cached_factorization(
+        truss_info, solver, partition, cache=cache, max_updates=max_updates,
+        options=options, precheck=precheck)
+    flat_deflections = backend.solve(factorization, flat_loads[ff, :])
+    if isinstance(factorization, UpdatedFactorization) and \
+            factorization.backward_error(flat_loads[ff, :],
+                                         flat_deflections) \
+            > UPDATE_TOLERANCE:
+        # The update has lost too much accuracy, so factor again
+        reset_cache(cache)
+        tj, SSfr, factorization = cached_factorization(
+            truss_info, solver, partition, cache=cache, options=options,
+            precheck=precheck)
+        flat_deflections = backend.solve(factorization, flat_loads[ff, :])
+    cond = factorization.condition(condition)
+
+    forces, deflections, reactions = backend.post_process(
+        truss_info, partition, tj, SSfr, flat_loads, flat_deflections)
+
+    if single_case:
+        return forces[0], deflections[0], reactions[0], cond
+    else:
+        return forces, deflections, reactions, cond
+
+
+def compare_backends(truss_info, names=None, partition=None, **options):
+    # Solve a truss with several backends, by default every registered one
+    # that can run here, and return for each the largest difference of its
+    # member forces, deflections and reactions from those of the first,
+    # relative to the largest value of the first
+    if names is None:
+        names = [name for name in solvers[1:]
+                 if HAS_SCIPY or not backends[name].requires_scipy]
+    differences = {}
+    reference = None
+    for name in names:
+        results = the_forces(truss_info, solver=name, partition=partition,
+                             condition="off", **options)[0:3]
+        if reference is None:
+            reference = results
+        differences[name] = dict(
+            (key, np.max(np.abs(value - base))/max(np.max(np.abs(base)),
+                                                   np.finfo(float).tiny))
+            for key, value, base in zip(["forces", "deflections",
+                                         "reactions"], results, reference))
+    return differences
+
+
+def stiffness_pattern(truss_info, ff):
+    # The unit stiffness blocks of all members (the member stiffness matrix
+    # divided by EA/L), reduced to the free DOFs and flattened into the rows
+    # of an (m, f*f) matrix. Also returns the member directions and lengths.
+    connections = truss_info["connections"]
+    coordinates = truss_info["coordinates"]
+    number_of_members = np.size(connections, axis=1)
+    directions, lengths = member_geometry(truss_info)
+
+    d2 = directions.T[:, :, None]*directions.T[:, None, :]
+    blocks = np.concatenate((np.concatenate((d2, -d2), axis=2),
+                             np.concatenate((-d2, d2), axis=2)), axis=1)
+
+    # Position of every block entry in the flattened K_ff, or -1 if it
+    # belongs to a restrained DOF
+    reduced = np.full(3*np.size(coordinates, axis=1), -1)
+    reduced[ff] = np.arange(len(ff))
+    e = reduced[np.hstack((3*connections[0, :, None] + np.arange(3),
+                           3*connections[1, :, None] + np.arange(3)))]
+    keep = (e[:, :, None] >= 0) & (e[:, None, :] >= 0)
+    rows = np.broadcast_to(np.arange(number_of_members)[:, None, None],
+                           blocks.shape)[keep]
+    cols = (len(ff)*e[:, :, None] + e[:, None, :])[keep]
+    shape = (number_of_members, len(ff)**2)
+    if HAS_SCIPY:
+        pattern = scipy.sparse.csr_matrix((blocks[keep], (rows, cols)),
+                                          shape=shape)
+    else:
+        pattern = np.zeros(shape)
+        np.add.at(pattern, (rows, cols), blocks[keep])
+    return pattern, directions, lengths
+
+
+def batch_forces(truss_info, solver="auto", partition=None):
+    # Member forces and deflections of k variants of one truss. The variants
+    # share geometry and supports, and differ in area and elastic modulus,
+    # shape (k, m), and loads, shape (k, 3, n). Dense variants are solved by
+    # the batched backend, as stacks of matrices, others one at a time.
+    # Variants with a singular stiffness matrix get NaN results.
+    if solver not in solvers:
+        raise ValueError(solver+' is not a defined solver. Try ' +
+                         ', '.join(solvers[0:-1]) + ', or ' +
+                         solvers[-1] + '.')
+    number_of_joints = np.size(truss_info["reactions"], axis=1)
+    if partition is None:
+        partition = partition_dofs(truss_info["reactions"])
+    ff, rr = partition
+
+    area = np.atleast_2d(truss_info["area"])
+    elastic_modulus = np.broadcast_to(truss_info["elastic_modulus"],
+                                      area.shape)
+    loads = np.broadcast_to(truss_info["loads"],
+                            (len(area), 3, number_of_joints))
+    forces = np.full(area.shape, np.nan)
+    deflections = np.full(loads.shape, np.nan)
+
+    if solver == "auto":
+        solver = pick_solver(3*number_of_joints, stiffness_density(
+            number_of_joints, np.size(area, axis=1)))
+        if solver == "cholesky":
+            solver = "batched"
+    if solver == "dense":
+        solver = "batched"
+
+    if solver != "batched":
+        for i in range(len(area)):
+            variant = dict(truss_info, area=area[i],
+                           elastic_modulus=elastic_modulus[i], loads=loads[i])
+            try:
+                forces[i], deflections[i], _, _ = the_forces(
+                    variant, solver=solver, partition=partition,
+                    condition="off")
+            except (np.linalg.LinAlgError, RuntimeError):
+                pass
+        return forces, deflections
+
+    # Stacks of variants are limited to BATCH_ENTRIES matrix entries
+    step = max(1, BATCH_ENTRIES//max(len(ff)**2, 1))
+    for start in range(0, len(area), step):
+        block = slice(start, start + step)
+        variants = dict(truss_info, area=area[block],
+                        elastic_modulus=elastic_modulus[block],
+                        loads=loads[block])
+        try:
+            forces[block], deflections[block], _, _ = the_forces(
+                variants, solver=solver, partition=partition,
+                condition="off")
+        except np.linalg.LinAlgError:
+            pass
+
+    return forces, deflections
+
+
+def factors_of_safety(forces, member_info):
+    # Yielding and buckling FOS of every member. forces may hold one row per
+    # load case. Tension members get a negative buckling FOS.
+    with np.errstate(divide='ignore'):
+        fos_yielding = member_info["Fy"]/np.abs(forces/member_info["area"])
+        fos_buckling = -((np.pi**2)*member_info["elastic_modulus"]
+                         * member_info["I"]/(member_info["length"]**2))/forces
+    return fos_yielding, fos_buckling
+
+
+def deflection_sensitivity(forces, virtual_forces, member_info):
+    # Derivative of a deflection with respect to member areas, by virtual
+    # work. virtual_forces are the member forces under a unit load along
+    # that deflection, so the deflection is sum(N*n*L/(E*A)).
+    return -forces*virtual_forces*member_info["length"] \
+        / (member_info["elastic_modulus"]*member_info["area"]**2)
+
+
+def post_process(forces, member_info):
+    # Stresses and factors of safety of all members, and the governing member
+    # and limit state of the truss. forces may hold one row per load case.
+    stress = forces/member_info["area"]
+    fos_yielding, fos_buckling = factors_of_safety(forces, member_info)
+
+    # Tension members cannot buckle
+    buckling = np.where(fos_buckling > 0, fos_buckling, NO_BUCKLING_FOS)
+    truss_fos_buckling = np.min(buckling, axis=-1)
+    truss_fos_yielding = np.min(fos_yielding, axis=-1)
+
+    return {"stress": stress,
+            "fos_yielding": fos_yielding,
+            "fos_buckling": fos_buckling,
+            "governing_member": np.argmin(np.minimum(fos_yielding, buckling),
+                                          axis=-1),
+            "truss_fos_buckling": truss_fos_buckling,
+            "truss_fos_yielding": truss_fos_yielding,
+            "truss_fos_total": np.minimum(truss_fos_buckling,
+                                          truss_fos_yielding),
+            "limit_state": np.where(truss_fos_buckling < truss_fos_yielding,
+                                    'buckling', 'yielding')}
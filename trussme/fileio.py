@@ -0,0 +1,472 @@
+import collections
+import json
+import struct
+import warnings
+import numpy as np
+from trussme import member
+from trussme import physical_properties
+from trussme.physical_properties import materials, valid_member_name
+
+# Binary container: magic, header offset, array blocks, JSON header
+TRSB_MAGIC = b"TRSB0001"
+TRSB_ALIGNMENT = 64
+
+
+# Aliases accepted for member parameters in M lines
+parameter_names = {"radius": "r", "r": "r",
+                   "thickness": "t", "t": "t",
+                   "width": "w", "w": "w",
+                   "height": "h", "h": "h",
+                   "area": "area", "a": "area",
+                   "I_min": "I"}
+
+
+def line_error(idx, message):
+    return ValueError("Line " + str(idx+1) + ": " + message)
+
+
+def parse_table(records, width, kind):
+    # Tokenize all records of one kind in bulk into width columns of
+    # strings, without the leading record letter. Each column is a strided
+    # slice of the tokens. Only when the token count does not add up are
+    # the records checked one by one.
+    tokens = " ".join([line for idx, line in records]).split()
+    if len(tokens) == (width + 1)*len(records):
+        return [tokens[column::width + 1] for column in range(1, width + 1)]
+    for idx, line in records:
+        if len(line.split()) != width + 1:
+            raise line_error(idx, kind + " lines need " + str(width) +
+                             " values.")
+
+
+def convert_table(columns, dtype, records, kind):
+    # Convert string columns in bulk into a (k, len(columns)) array, and
+    # find the offending line on error
+    try:
+        return np.array([list(map(dtype, column)) for column in columns],
+                        dtype=dtype).T
+    except ValueError:
+        for row, (idx, line) in enumerate(records):
+            try:
+                [dtype(column[row]) for column in columns]
+            except ValueError:
+                raise line_error(idx, "invalid number in " + kind + " line.")
+        raise
+
+
+def empty_members(number_of_members):
+    # Connections, materials, shape codes and given parameters (NaN where
+    # not given) of number_of_members members
+    return (np.zeros([number_of_members, 2], dtype=int),
+            np.zeros(number_of_members, dtype=object),
+            np.zeros(number_of_members, dtype=np.int8),
+            dict((key, np.full(number_of_members, np.nan))
+                 for key in ["t", "w", "h", "r", "area", "I"]))
+
+
+def parse_member_table(records):
+    # Parse all M records in bulk. Every "key=value" parameter becomes the
+    # three tokens key, =, value, so a line with p parameters has 5 + 3*p
+    # tokens. Lines with the same p are tokenized together, and each column
+    # is a strided slice of their tokens, converted or looked up at once.
+    # Returns None if any record is malformed.
+    connections, material, shape, given = empty_members(len(records))
+    lines = [line for idx, line in records]
+    counts = np.array([line.count("=") for line in lines], dtype=int)
+    shape_codes = dict((name, k) for k, name in enumerate(member.Member.shapes))
+    for p in np.unique(counts).tolist():
+        rows = np.flatnonzero(counts == p)
+        width = 5 + 3*p
+        tokens = " ".join([lines[row] for row in rows]).replace(
+            "=", " = ").split()
+        if len(tokens) != width*len(rows) or \
+                any(token != "M" for token in set(tokens[0::width])):
+            return None
+        try:
+            connections[rows, 0] = list(map(int, tokens[1::width]))
+            connections[rows, 1] = list(map(int, tokens[2::width]))
+        except ValueError:
+            return None
+
+        names = tokens[3::width]
+        if not all(valid_member_name(name) for name in set(names)):
+            return None
+        material[rows] = names
+        names = tokens[4::width]
+        if not set(names).issubset(shape_codes):
+            return None
+        shape[rows] = [shape_codes[name] for name in names]
+
+        # Parameters column by column, so a repeated key keeps its last
+        # value, as in parse_member_lines
+        for column in range(5, width, 3):
+            if any(token != "=" for token in set(tokens[column + 1::width])):
+                return None
+            keys = tokens[column::width]
+            names = set(keys)
+            if not names.issubset(parameter_names):
+                return None
+            try:
+                values = np.array(list(map(float,
+                                           tokens[column + 2::width])))
+            except ValueError:
+                return None
+            if len(names) == 1:
+                given[parameter_names[keys[0]]][rows] = values
+                continue
+            keys = np.array(keys)
+            for name in names:
+                k = keys == name
+                given[parameter_names[name]][rows[k]] = values[k]
+    return connections, material, shape, given
+
+
+def parse_member_lines(records):
+    # Parse M records one line at a time, raising an error that names the
+    # line of the first malformed record
+    connections, material, shape, given = empty_members(len(records))
+    for row, (idx, line) in enumerate(records):
+        info = line.split()[1:]
+        if len(info) < 4:
+            raise line_error(idx, "M lines need two joints, a material "
+                                  "and a shape.")
+        try:
+            connections[row] = [int(info[0]), int(info[1])]
+        except ValueError:
+            raise line_error(idx, "invalid joint in M line.")
+        if not valid_member_name(info[2]):
+            raise line_error(idx, info[2] + " is not a defined material.")
+        if info[3] not in member.Member.shapes:
+            raise line_error(idx, info[3] + " is not a defined shape.")
+        material[row] = info[2]
+        shape[row] = member.Member.shapes.index(info[3])
+        for param in info[4:]:
+            kvpair = param.split("=")
+            if len(kvpair) != 2 or kvpair[0] not in parameter_names:
+                raise line_error(idx, param + " is not a defined parameter. "
+                                 "Try thickness (t), width (w), height (h), "
+                                 "radius (r), area (a) or I_min.")
+            try:
+                given[parameter_names[kvpair[0]]][row] = float(kvpair[1])
+            except ValueError:
+                raise line_error(idx, "invalid number in M line.")
+    return connections, material, shape, given
+
+
+def read_trs(file_name):
+    # Read a .trs file into a compact intermediate representation: a dict of
+    # arrays that Truss.build turns into a model in one go
+    with open(file_name, 'r') as f:
+        lines = f.read().splitlines()
+
+    # Sort the records by kind
+    joint_records = []
+    member_records = []
+    load_records = []
+    load_cases = collections.OrderedDict()
+    g = None
+    for idx, line in enumerate(lines):
+        # Joints and members, most of a file, are tested for first
+        kind = line[:1]
+        if kind == "J":
+            joint_records.append((idx, line))
+        elif kind == "M":
+            member_records.append((idx, line))
+        elif kind == "" or kind == "#" or line.isspace():
+            continue
+        elif line[:2] == "LC":
+            # LC name declares a load case, and LC name joint x y z adds a
+            # load to it, so case loads never depend on the line order
+            info = line.split()[1:]
+            if len(info) == 0:
+                raise line_error(idx, "load case has no name.")
+            records = load_cases.setdefault(info[0], [])
+            if len(info) > 1:
+                records.append((idx, " ".join(["LC"] + info[1:])))
+        elif line[0] == "L":
+            # In older files, L lines after an LC line were loads of that
+            # case. Rather than read them as joint loads, they are rejected.
+            if len(load_cases) > 0:
+                raise line_error(idx, "L lines cannot follow LC lines. Give "
+                                      "case loads as LC name joint x-load "
+                                      "y-load z-load.")
+            load_records.append((idx, line))
+        elif line[0] == "P":
+            info = line.split()[1:]
+            # If g is defined, overwrite fallback values
+            if len(info) > 0 and info[0] == "g":
+                try:
+                    g = np.array([float(x) for x in info[1:4]])
+                except ValueError:
+                    raise line_error(idx, "invalid number in P line.")
+        else:
+            raise line_error(idx, "'" + line[0] +
+                             "' is not a valid line beginner.")
+
+    # Joints: J x y z x-support y-support z-support
+    table = parse_table(joint_records, 6, "J")
+    number_of_joints = len(joint_records)
+    if number_of_joints == 0:
+        coordinates = np.zeros([0, 3])
+        translation = np.zeros([0, 3], dtype=int)
+    else:
+        coordinates = convert_table(table[:3], float, joint_records, "J")
+        translation = convert_table(table[3:], int, joint_records, "J")
+
+    def parse_loads(records, kind):
+        # L joint x-load y-load z-load, or the same after LC name
+        if len(records) == 0:
+            return np.zeros(0, dtype=int), np.zeros([0, 3])
+        table = parse_table(records, 4, kind)
+        joints = convert_table(table[:1], int, records, kind)[:, 0]
+        missing = (joints < 0) | (joints >= number_of_joints)
+        for row in np.flatnonzero(missing):
+            raise line_error(records[row][0], "joint " + str(joints[row]) +
+                             " does not exist.")
+        return joints, convert_table(table[1:], float, records, kind)
+
+    loads = np.zeros([number_of_joints, 3])
+    joints, values = parse_loads(load_records, "L")
+    loads[joints] = values
+    for name in load_cases:
+        load_cases[name] = parse_loads(load_cases[name], "LC")
+
+    # Members: M joint-a joint-b material shape {parameters}. Only when
+    # the bulk parser rejects the records are they parsed line by line, to
+    # find the offending line.
+    members = parse_member_table(member_records)
+    if members is None:
+        members = parse_member_lines(member_records)
+    connections, material, shape, given = members
+    for row in np.flatnonzero((connections < 0).any(axis=1) |
+                              (connections >= number_of_joints).any(axis=1)):
+        raise line_error(member_records[row][0],
+                         "member connects a joint that does not exist.")
+
+    return {"coordinates": coordinates,
+            "translation": translation,
+            "loads": loads,
+            "connections": connections,
+            "material": material,
+            "shape": shape,
+            "parameters": given,
+            "load_cases": load_cases,
+            "g": g}
+
+
+def member_parameters(shape, given):
+    # Section parameters as they end up after Member.__init__, set_shape and
+    # set_parameters: the default pipe, parameters that do not apply to the
+    # shape set to NaN ("N/A"), then the given values
+    number_of_members = len(shape)
+    default = member.compute_properties_batch(
+        [member.Member.shapes.index("pipe")], [0.002], [np.nan], [np.nan],
+        [0.02], [0.0])
+    parameters = {"t": np.full(number_of_members, 0.002),
+                  "w": np.full(number_of_members, np.nan),
+                  "h": np.full(number_of_members, np.nan),
+                  "r": np.full(number_of_members, 0.02),
+                  "area": np.full(number_of_members, default["area"][0]),
+                  "I": np.full(number_of_members, default["I"][0])}
+
+    not_applicable = {"pipe": ["w", "h"],
+                      "bar": ["w", "h", "r"],
+                      "square": ["r", "t"],
+                      "box": ["r"],
+                      "arbitrary": ["t", "w", "h", "r"]}
+    for name in not_applicable:
+        k = shape == member.Member.shapes.index(name)
+        for key in not_applicable[name]:
+            parameters[key][k] = np.nan
+
+    for key in parameters:
+        k = ~np.isnan(given[key])
+        parameters[key][k] = given[key][k]
+    return parameters
+
+
+def check_parameters(shape, parameters):
+    # Same checks as Member.set_parameters, for all members at once
+    t, w, h, r = [parameters[key] for key in ["t", "w", "h", "r"]]
+    pipe = shape == member.Member.shapes.index("pipe")
+    box = shape == member.Member.shapes.index("box")
+    arbitrary = shape == member.Member.shapes.index("arbitrary")
+    with np.errstate(invalid='ignore'):
+        checks = [(pipe & (t > r), "Thickness is greater than radius."
+                                   "Changing shape to bar."),
+                  (box & (2*t > w), "Thickness is greater than half of width."
+                                    "Changing shape to square."),
+                  (box & ~(2*t > w) & (2*t > h),
+                   "Thickness is greater than half of height."
+                   "Changing shape to square."),
+                  (arbitrary & (parameters["area"] <= 0.0),
+                   'Shape type "arbitrary" needs parameter "area (a)" with '
+                   'positive value.'),
+                  (arbitrary & (parameters["I"] <= 0.0),
+                   'Shape type "arbitrary" needs parameter "I_min" with '
+                   'positive value.')]
+    for mask, message in checks:
+        for i in range(np.count_nonzero(mask)):
+            warnings.warn(message)
+
+
+def material_properties(material):
+    # E, Fy and rho of every member, looked up once per distinct material
+    names, inverse = np.unique(material.astype(str), return_inverse=True)
+    properties = {}
+    for key, column in [("E", "elastic_modulus"), ("Fy", "Fy"),
+                        ("rho", "rho")]:
+        values = np.array([materials[name][key] for name in names],
+                          dtype=float)
+        properties[column] = values[inverse] if len(names) \
+            else np.zeros(0)
+    return properties
+
+
+def write_trs(model, file_name):
+    # Write a model dict as a .trs text file, collecting all lines first and
+    # writing them in one go
+    lines = []
+
+    # Do the joints. tolist() gives Python numbers, whose str() round-trips.
+    for coordinates, translation in zip(model["coordinates"].tolist(),
+                                        model["translation"].tolist()):
+        lines.append("J\t" + "\t".join(str(x) for x in coordinates) + "\t" +
+                     "\t".join(str(x) for x in translation) + "\n")
+
+    # Do the members. Parameters that do not apply are NaN.
+    parameters = [(key, model["parameters"][key].tolist())
+                  for key in ["t", "r", "w", "h"]]
+    arbitrary = model["shape"] == member.Member.shapes.index("arbitrary")
+    for i, (a, b) in enumerate(model["connections"].tolist()):
+        line = "M\t" + str(a) + "\t" + str(b) + "\t" + model["material"][i] \
+            + "\t" + member.Member.shapes[model["shape"][i]] + "\t"
+        for key, values in parameters:
+            if values[i] == values[i]:
+                line += key + "=" + str(values[i]) + "\t"
+        if arbitrary[i]:
+            line += "a=" + str(float(model["parameters"]["area"][i])) + "\t" \
+                + "I_min=" + str(float(model["parameters"]["I"][i])) + "\t"
+        lines.append(line + "\n")
+
+    # Do the loads
+    loads = model["loads"].tolist()
+    for idx in np.flatnonzero(np.any(model["loads"] != 0, axis=1)):
+        lines.append("L\t" + str(idx) + "\t" +
+                     "\t".join(str(x) for x in loads[idx]) + "\t\n")
+
+    # Do the load cases, with a bare LC line for a case without loads
+    for name in model["load_cases"]:
+        joints, values = model["load_cases"][name]
+        if len(joints) == 0:
+            lines.append("LC\t" + str(name) + "\n")
+        for idx, load in zip(joints.tolist(), values.tolist()):
+            lines.append("LC\t" + str(name) + "\t" + str(idx) + "\t" +
+                         "\t".join(str(x) for x in load) + "\t\n")
+
+    # Do the physical properties, if they differ from the fallback values
+    if model["g"] is not None and \
+            np.any(model["g"] != np.asarray(physical_properties.g)):
+        lines.append("P\tg\t" + "\t".join(str(x) for x in
+                                          model["g"].tolist()) + "\n")
+
+    with open(file_name, "w") as f:
+        f.write("".join(lines))
+
+
+def write_trsb(model, file_name):
+    # Write a model dict as a .trsb binary container. Every array is stored
+    # raw and little-endian at an aligned offset, so it can be memory-mapped,
+    # and the JSON header at the end describes where each one is.
+    material_names = sorted(set(model["material"]))
+    codes = dict((name, i) for i, name in enumerate(material_names))
+    case_names = list(model["load_cases"].keys())
+    case_arrays = [model["load_cases"][name] for name in case_names]
+    arrays = [("coordinates", model["coordinates"], "<f8"),
+              ("translation", model["translation"], "<i8"),
+              ("loads", model["loads"], "<f8"),
+              ("connections", model["connections"], "<i8"),
+              ("material", [codes[name] for name in model["material"]],
+               "<i4"),
+              ("shape", model["shape"], "i1")]
+    for key in ["t", "w", "h", "r", "area", "I"]:
+        arrays.append(("parameter_" + key, model["parameters"][key], "<f8"))
+    arrays += [("case_index", np.repeat(np.arange(len(case_names)),
+                                        [len(j) for j, l in case_arrays]),
+                "<i4"),
+               ("case_joint", np.concatenate([np.zeros(0)] + [
+                   j for j, l in case_arrays]), "<i8"),
+               ("case_load", np.concatenate([np.zeros([0, 3])] + [
+                   l for j, l in case_arrays]), "<f8")]
+
+    header = {"materials": material_names,
+              "load_cases": [str(name) for name in case_names],
+              "g": None if model["g"] is None else model["g"].tolist(),
+              "arrays": {}}
+    with open(file_name, "wb") as f:
+        f.write(TRSB_MAGIC + struct.pack("<Q", 0))
+        for name, value, dtype in arrays:
+            value = np.ascontiguousarray(value, dtype=dtype)
+            f.write(b"\0"*(-f.tell() % TRSB_ALIGNMENT))
+            header["arrays"][name] = {"dtype": dtype,
+                                      "shape": list(value.shape),
+                                      "offset": f.tell()}
+            f.write(value.tobytes())
+        header_offset = f.tell()
+        f.write(json.dumps(header).encode("utf-8"))
+        f.seek(len(TRSB_MAGIC))
+        f.write(struct.pack("<Q", header_offset))
+
+
+def read_trsb_arrays(file_name, mmap=True):
+    # The raw arrays and the header of a .trsb file. With mmap, the arrays
+    # are copy-on-write memory maps, so opening a file reads almost nothing.
+    # Truss.build still copies them into its own storage and makes a view
+    # per joint and member, so only callers of the raw arrays save the work.
+    with open(file_name, "rb") as f:
+        if f.read(len(TRSB_MAGIC)) != TRSB_MAGIC:
+            raise ValueError(file_name + " is not a .trsb file.")
+        header_offset = struct.unpack("<Q", f.read(8))[0]
+        f.seek(header_offset)
+        header = json.loads(f.read().decode("utf-8"))
+
+        arrays = {}
+        for name, info in header["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            shape = tuple(info["shape"])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(file_name, dtype=dtype, mode='c',
+                                         offset=info["offset"], shape=shape)
+            else:
+                f.seek(info["offset"])
+                arrays[name] = np.fromfile(
+                    f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return arrays, header
+
+
+def read_trsb(file_name, mmap=True):
+    # Read a .trsb file into the same model dict as read_trs
+    arrays, header = read_trsb_arrays(file_name, mmap=mmap)
+    material_names = np.array(header["materials"] + [""], dtype=object)
+    for name in header["materials"]:
+        if not valid_member_name(name):
+            raise ValueError(name + " is not a defined material.")
+
+    load_cases = collections.OrderedDict()
+    for k, name in enumerate(header["load_cases"]):
+        rows = arrays["case_index"] == k
+        load_cases[name] = (arrays["case_joint"][rows],
+                            arrays["case_load"][rows])
+
+    return {"coordinates": arrays["coordinates"],
+            "translation": arrays["translation"],
+            "loads": arrays["loads"],
+            "connections": arrays["connections"],
+            "material": material_names[arrays["material"]],
+            "shape": arrays["shape"],
+            "parameters": dict((key, arrays["parameter_" + key])
+                               for key in ["t", "w", "h", "r", "area", "I"]),
+            "load_cases": load_cases,
+            "g": None if header["g"] is None else np.array(header["g"])}
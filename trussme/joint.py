@@ -1,29 +1,112 @@
 import numpy as np
 
 
+class JointArrays(object):
+    # Contiguous per-joint storage, one row per joint. A Truss owns one of
+    # these, and its Joint objects are views into the rows.
+
+    def __init__(self, capacity=16):
+        self.count = 0
+        self.coordinates = np.zeros([capacity, 3])
+        self.translation = np.zeros([capacity, 3], dtype=int)
+        self.loads = np.zeros([capacity, 3])
+        self.reactions = np.zeros([capacity, 3])
+        self.deflections = np.zeros([capacity, 3])
+
+    def extend(self, count):
+        # Make room for count more joints and return the first new row. Grow
+        # geometrically, so adding n joints costs O(n) copies.
+        if self.count + count > len(self.coordinates):
+            capacity = max(2*len(self.coordinates), self.count + count)
+            for name in ["coordinates", "translation", "loads", "reactions",
+                         "deflections"]:
+                old = getattr(self, name)
+                new = np.zeros([capacity, 3], dtype=old.dtype)
+                new[:self.count] = old[:self.count]
+                setattr(self, name, new)
+
+        self.count += count
+        return self.count - count
+
+    def append(self, coordinates):
+        row = self.extend(1)
+        self.coordinates[row] = np.ravel(coordinates)
+        return row
+
+
 class Joint(object):
 
-    def __init__(self, coordinates):
+    __slots__ = ["idx", "members", "_data", "_row"]
+
+    def __init__(self, coordinates, data=None):
         # Save the joint id
         self.idx = -1
 
-        # Coordinates of the joint
-        self.coordinates = coordinates
+        # Row in the array storage. A joint created on its own gets a
+        # private single-row storage.
+        if data is None:
+            data = JointArrays(capacity=1)
+        self._data = data
+        self._row = data.append(coordinates)
 
         # Allowed translation in x, y, and z
         self.translation = np.ones([3, 1])
 
-        # Loads
-        self.loads = np.zeros([3, 1])
-
         # Store connected members
         self.members = []
 
-        # Loads
-        self.reactions = np.zeros([3, 1])
+    @classmethod
+    def view(cls, data, row):
+        # Joint backed by an existing row of the array storage
+        j = cls.__new__(cls)
+        j.idx = row
+        j.members = []
+        j._data = data
+        j._row = row
+        return j
+
+    # Coordinates of the joint, shape (3,)
+    @property
+    def coordinates(self):
+        return self._data.coordinates[self._row]
+
+    @coordinates.setter
+    def coordinates(self, value):
+        self._data.coordinates[self._row] = np.ravel(value)
+
+    # Support flags, loads, reactions and deflections are (3, 1) views, so
+    # item assignment such as joint.loads[1] = -100 writes to the storage
+    @property
+    def translation(self):
+        return self._data.translation[self._row][:, None]
+
+    @translation.setter
+    def translation(self, value):
+        self._data.translation[self._row] = np.ravel(value)
+
+    @property
+    def loads(self):
+        return self._data.loads[self._row][:, None]
+
+    @loads.setter
+    def loads(self, value):
+        self._data.loads[self._row] = np.ravel(value)
+
+    @property
+    def reactions(self):
+        return self._data.reactions[self._row][:, None]
+
+    @reactions.setter
+    def reactions(self, value):
+        self._data.reactions[self._row] = np.ravel(value)
+
+    @property
+    def deflections(self):
+        return self._data.deflections[self._row][:, None]
 
-        # Loads
-        self.deflections = np.zeros([3, 1])
+    @deflections.setter
+    def deflections(self, value):
+        self._data.deflections[self._row] = np.ravel(value)
 
     def free(self, d=3):
         self.translation = np.zeros([3, 1])
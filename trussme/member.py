@@ -1,53 +1,236 @@
+import math
 import numpy as np
 import warnings
 from trussme.physical_properties import materials, valid_member_name
 
 
+class MemberArrays(object):
+    # Contiguous per-member storage, one entry per member. A Truss owns one
+    # of these, and its Member objects are views into the entries.
+
+    # Float columns. Shape parameters that do not apply are stored as NaN.
+    columns = ["t", "w", "h", "r", "elastic_modulus", "Fy", "rho", "area",
+               "I", "LW", "length", "mass", "force", "stress", "fos_yielding",
+               "fos_buckling"]
+
+    def __init__(self, capacity=16):
+        self.count = 0
+        for name in self.columns:
+            setattr(self, name, np.zeros(capacity))
+        self.connections = np.zeros([capacity, 2], dtype=int)
+        self.shape = np.full(capacity, -1, dtype=np.int8)
+        self.material = np.full(capacity, '', dtype=object)
+
+    def extend(self, count):
+        # Make room for count more members and return the first new entry.
+        # Grow geometrically, so adding n members costs O(n) copies.
+        if self.count + count > len(self.shape):
+            capacity = max(2*len(self.shape), self.count + count)
+            for name in self.columns + ["connections", "shape", "material"]:
+                old = getattr(self, name)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.count] = old[:self.count]
+                setattr(self, name, new)
+
+        self.count += count
+        return self.count - count
+
+    def append(self):
+        return self.extend(1)
+
+
+def cube(x):
+    return x*x*x
+
+
+def fourth(x):
+    return (x*x)*(x*x)
+
+
+def compute_properties_batch(shape, t, w, h, r, rho, area=None, I=None,
+                             length=None):
+    # Section properties of many members in one pass. shape holds shape
+    # codes (indices into Member.shapes) or names, the other arguments are
+    # arrays with one entry per member. Area and I of "arbitrary" members
+    # are taken from the area and I arguments.
+    shape = np.asarray(shape)
+    if shape.dtype.kind in "USO":
+        shape = np.array([Member.shapes.index(name) for name in shape])
+    t, w, h, r = [np.asarray(x, dtype=float) for x in (t, w, h, r)]
+    area = np.zeros(len(shape)) if area is None \
+        else np.array(area, dtype=float)
+    I = np.zeros(len(shape)) if I is None else np.array(I, dtype=float)
+
+    pipe = shape == Member.shapes.index("pipe")
+    bar = shape == Member.shapes.index("bar")
+    square = shape == Member.shapes.index("square")
+    box = shape == Member.shapes.index("box")
+    tall = h > w
+
+    # Moment of inertia. Powers are written as products, which round the
+    # same for arrays and for the floats of Member.calc_moi, so both give
+    # identical results.
+    ri = r[pipe] - 2*t[pipe]
+    I[pipe] = (np.pi/4.)*(fourth(r[pipe]) - fourth(ri))
+    I[bar] = (np.pi/4.)*fourth(r[bar])
+    k = square & tall
+    I[k] = (1./12.)*w[k]*cube(h[k])
+    k = square & ~tall
+    I[k] = (1./12.)*h[k]*cube(w[k])
+    k = box & tall
+    I[k] = (1./12.)*(w[k]*cube(h[k])) \
+        - (1./12.)*(w[k] - 2*t[k])*cube(h[k] - 2*t[k])
+    k = box & ~tall
+    I[k] = (1./12.)*(h[k]*cube(w[k])) \
+        - (1./12.)*(h[k] - 2*t[k])*cube(w[k] - 2*t[k])
+
+    # Cross-sectional area
+    ri = r[pipe] - t[pipe]
+    area[pipe] = np.pi*(r[pipe]*r[pipe] - ri*ri)
+    area[bar] = np.pi*r[bar]*r[bar]
+    area[box] = w[box]*h[box] - (h[box] - 2*t[box])*(w[box] - 2*t[box])
+    area[square] = w[square]*h[square]
+
+    # Linear weight, and mass if the lengths are known
+    properties = {"area": area, "I": I, "LW": area*rho}
+    if length is not None:
+        properties["mass"] = length*properties["LW"]
+    return properties
+
+
+def calc_lengths(end_a, end_b):
+    # Member lengths from end coordinates, one member per row
+    return np.sqrt(np.sum((np.asarray(end_a) - np.asarray(end_b))**2,
+                          axis=-1))
+
+
+def array_property(name):
+    # Attribute stored in column name of the member arrays
+    def getter(self):
+        return getattr(self._data, name)[self._row]
+
+    def setter(self, value):
+        getattr(self._data, name)[self._row] = value
+
+    return property(getter, setter)
+
+
+def parameter_property(name):
+    # Shape parameter that reads "N/A" when it does not apply to the shape
+    def getter(self):
+        value = getattr(self._data, name)[self._row]
+        return "N/A" if np.isnan(value) else value
+
+    def setter(self, value):
+        getattr(self._data, name)[self._row] = \
+            np.nan if value == "N/A" else value
+
+    return property(getter, setter)
+
+
 class Member(object):
 
     # Shape types
     shapes = ["pipe", "bar", "square", "box", "arbitrary"]
 
-    def __init__(self, joint_a, joint_b):
+    # Parameters that do not apply to each shape, stored as NaN ("N/A")
+    unused_parameters = {"pipe": ["w", "h"],
+                         "bar": ["w", "h", "r"],
+                         "square": ["r", "t"],
+                         "box": ["r"],
+                         "arbitrary": ["t", "w", "h", "r"]}
+
+    __slots__ = ["idx", "_joints", "_data", "_row"]
+
+    # Shape independent variables
+    t = parameter_property("t")  # thickness
+    w = parameter_property("w")  # outer width
+    h = parameter_property("h")  # outer height
+    r = parameter_property("r")  # outer radius
+
+    # Material properties
+    elastic_modulus = array_property("elastic_modulus")  # Elastic modulus
+    Fy = array_property("Fy")  # yield strength
+    rho = array_property("rho")  # material density
+
+    # Dependent variables
+    area = array_property("area")  # Cross-sectional area
+    I = array_property("I")  # Moment of inertia
+    LW = array_property("LW")  # Linear weight
+
+    # Variables to store information about truss state
+    force = array_property("force")
+    fos_yielding = array_property("fos_yielding")
+    fos_buckling = array_property("fos_buckling")
+    mass = array_property("mass")
+    stress = array_property("stress")
+    length = array_property("length")
+
+    def __init__(self, joint_a, joint_b, data=None):
         # Save id number
         self.idx = -1
 
-        # Shape independent variables
-        self.shape = ''
-        self.t = 0.0  # thickness
-        self.w = 0.0  # outer width
-        self.h = 0.0  # outer height
-        self.r = 0.0  # outer radius
-
-        # Material properties
-        self.material = ''  # string specifying material
-        self.elastic_modulus = 0.0        # Elastic modulus
-        self.Fy = 0.0       # yield strength
-        self.rho = 0.0      # material density
-
-        # Dependent variables
-        self.area = 0.0   # Cross-sectional area
-        self.I = 0.0   # Moment of inertia
-        self.LW = 0.0  # Linear weight
-
-        # Variables to store information about truss state
-        self.force = 0
-        self.fos_yielding = 0
-        self.fos_buckling = 0
-        self.mass = 0
-        self.stress = 0
+        # Entry in the array storage. A member created on its own gets a
+        # private single-entry storage.
+        if data is None:
+            data = MemberArrays(capacity=1)
+        self._data = data
+        self._row = data.append()
 
         # Variable to store location in truss
         self.joints = [joint_a, joint_b]
-        self.length = 0
-        self.end_a = []
-        self.end_b = []
 
         # Calculate properties
         self.set_shape("pipe", update_props=False)
         self.set_material("A36", update_props=False)
         self.set_parameters(t=0.002, r=0.02, update_props=True)
 
+    @classmethod
+    def view(cls, data, row, joints):
+        # Member backed by an existing entry of the array storage, whose
+        # connections are already filled in
+        m = cls.__new__(cls)
+        m.idx = row
+        m._joints = list(joints)
+        m._data = data
+        m._row = row
+        return m
+
+    @property
+    def shape(self):
+        code = int(self._data.shape[self._row])
+        return self.shapes[code] if code >= 0 else ''
+
+    @shape.setter
+    def shape(self, value):
+        self._data.shape[self._row] = self.shapes.index(value)
+
+    @property
+    def material(self):
+        return self._data.material[self._row]  # string specifying material
+
+    @material.setter
+    def material(self, value):
+        self._data.material[self._row] = value
+
+    @property
+    def joints(self):
+        return self._joints
+
+    @joints.setter
+    def joints(self, value):
+        # Keep the joint indices in the arrays in step for the analysis
+        self._joints = list(value)
+        self._data.connections[self._row] = [j.idx for j in self._joints]
+
+    @property
+    def end_a(self):
+        return self._joints[0].coordinates
+
+    @property
+    def end_b(self):
+        return self._joints[1].coordinates
+
     def set_shape(self, new_shape, update_props=True):
         # Read and save hte shape name
         if self.shape_name_is_ok(new_shape):
@@ -57,23 +240,10 @@ class Member(object):
                              ', '.join(self.shapes[0:-1]) + ', or ' +
                              self.shapes[-1] + '.')
 
-        if self.shape == "pipe":
-            self.w = "N/A"
-            self.h = "N/A"
-        elif self.shape == "bar":
-            self.w = "N/A"
-            self.h = "N/A"
-            self.r = "N/A"
-        elif self.shape == "square":
-            self.r = "N/A"
-            self.t = "N/A"
-        elif self.shape == "box":
-            self.r = "N/A"
-        elif self.shape == "arbitrary":
-            self.t = "N/A"
-            self.w = "N/A"
-            self.h = "N/A"
-            self.r = "N/A"
+        # Written to the arrays directly, rather than through the parameter
+        # properties, as this runs for every member built
+        for name in self.unused_parameters[new_shape]:
+            getattr(self._data, name)[self._row] = np.nan
 
         # If required, update properties
         if update_props:
@@ -97,7 +267,10 @@ class Member(object):
             self.calc_properties()
 
     def set_parameters(self, **kwargs):
-        # prop_update = False
+        # Properties can be left stale, e.g. to update many members at once
+        # with Truss.update_properties
+        update_props = kwargs.pop("update_props", True)
+
         # Save the values
         for key in kwargs.keys():
             if key == "radius":
@@ -122,19 +295,18 @@ class Member(object):
                 self.area = kwargs["a"]
             elif key == "I_min":
                 self.I = kwargs["I_min"]
-            elif kwargs["update_props"]:
-                prop_update = True
             else:
                 raise ValueError(key+' is not a defined parameter. '
                                      'Try thickness (t), width (w), '
                                      'height (h), radius (r), area (a) or I_min.')
 
         # Check parameters
-        if self.shape == "pipe":
+        shape = self.shape
+        if shape == "pipe":
             if self.t > self.r:
                 warnings.warn("Thickness is greater than radius."
                               "Changing shape to bar.")
-        if self.shape == "box":
+        if shape == "box":
             if 2*self.t > self.w:
                 warnings.warn("Thickness is greater than half of width."
                               "Changing shape to square.")
@@ -142,16 +314,14 @@ class Member(object):
                 warnings.warn("Thickness is greater than half of height."
                               "Changing shape to square.")
 
-        if self.shape == "arbitrary":
+        if shape == "arbitrary":
             if self.area <= 0.0:
                 warnings.warn('Shape type "arbitrary" needs parameter "area (a)" with positive value.')
             if self.I <= 0.0:
                 warnings.warn('Shape type "arbitrary" needs parameter "I_min" with positive value.')
 
-        # if prop_update:
-        #    self.calc_properties()
-
-        self.calc_properties()
+        if update_props:
+            self.calc_properties()
 
     def calc_properties(self):
         # Calculate moment of inertia
@@ -166,46 +336,61 @@ class Member(object):
         # Update length, etc.
         self.calc_geometry()
 
+    def section_parameters(self):
+        # t, w, h and r as floats, NaN where they do not apply to the shape
+        data, row = self._data, self._row
+        return (float(data.t[row]), float(data.w[row]), float(data.h[row]),
+                float(data.r[row]))
+
     def calc_moi(self):
-        if self.shape == "pipe":
-            self.I = (np.pi/4.)*(self.r**4 - (self.r - 2*self.t)**4)
-        elif self.shape == "bar":
-            self.I = (np.pi/4.)*self.r**4
-        elif self.shape == "square":
-            if self.h > self.w:
-                self.I = (1./12.)*self.w*self.h**3
+        # The same formulas as compute_properties_batch, for one member.
+        # Calling the batch routine on a single row costs far more than the
+        # arithmetic, so single-member updates keep their own.
+        t, w, h, r = self.section_parameters()
+        shape = self.shape
+        if shape == "pipe":
+            self.I = (np.pi/4.)*(fourth(r) - fourth(r - 2*t))
+        elif shape == "bar":
+            self.I = (np.pi/4.)*fourth(r)
+        elif shape == "square":
+            if h > w:
+                self.I = (1./12.)*w*cube(h)
             else:
-                self.I = (1./12.)*self.h*self.w**3
-        elif self.shape == "box":
-            if self.h > self.w:
-                self.I = (1./12.)*(self.w*self.h**3)\
-                    - (1./12.)*(self.w - 2*self.t)*(self.h - 2*self.t)**3
+                self.I = (1./12.)*h*cube(w)
+        elif shape == "box":
+            if h > w:
+                self.I = (1./12.)*(w*cube(h)) \
+                    - (1./12.)*(w - 2*t)*cube(h - 2*t)
             else:
-                self.I = (1./12.)*(self.h*self.w**3)\
-                    - (1./12.)*(self.h - 2*self.t)*(self.w - 2*self.t)**3
-        elif self.shape == "arbitrary":
+                self.I = (1./12.)*(h*cube(w)) \
+                    - (1./12.)*(h - 2*t)*cube(w - 2*t)
+        elif shape == "arbitrary":
             pass  # I_min is already set by parameter
 
     def calc_area(self):
-        if self.shape == "pipe":
-            self.area = np.pi*(self.r**2 - (self.r-self.t)**2)
-        elif self.shape == "bar":
-            self.area = np.pi*self.r**2
-        elif self.shape == "box":
-            self.area = self.w*self.h - (self.h - 2*self.t)*(self.w - 2*self.t)
-        elif self.shape == "square":
-            self.area = self.w * self.h
-        elif self.shape == "arbitrary":
+        t, w, h, r = self.section_parameters()
+        shape = self.shape
+        if shape == "pipe":
+            self.area = np.pi*(r*r - (r - t)*(r - t))
+        elif shape == "bar":
+            self.area = np.pi*r*r
+        elif shape == "box":
+            self.area = w*h - (h - 2*t)*(w - 2*t)
+        elif shape == "square":
+            self.area = w*h
+        elif shape == "arbitrary":
             pass  # Area is already set by parameter
 
     def calc_lw(self):
         self.LW = self.area * self.rho
 
     def calc_geometry(self):
-        self.end_a = self.joints[0].coordinates
-        self.end_b = self.joints[1].coordinates
-        self.length = np.linalg.norm(self.end_a - self.end_b)
-        self.mass = self.length*self.LW
+        # Summed in the same order as calc_lengths, for identical results
+        # without the overhead of array operations on one member
+        dx, dy, dz = (self.end_a - self.end_b).tolist()
+        length = math.sqrt(dx*dx + dy*dy + dz*dz)
+        self.length = length
+        self.mass = length*self.LW
 
     def set_force(self, the_force):
         self.force = the_force
@@ -0,0 +1,202 @@
+import warnings
+import numpy as np
+from trussme import evaluate
+from trussme import member
+
+# Section parameters that scale with the member dimensions
+dimensions = ["t", "w", "h", "r"]
+
+
+def required_areas(forces, weight_forces, member_info, fos_yielding_goal,
+                   fos_buckling_goal):
+    # Factor on the area of every member that brings its FOS to the goal.
+    # Member forces are split into the part from the loads, which is taken
+    # as fixed, and the part from self-weight, whose sensitivity to the area
+    # of the member is weight_forces/area. I grows with the square of the
+    # area, as it does when all dimensions are scaled. Returns the factors
+    # and the members whose self-weight alone rules out the yielding goal,
+    # which keep their area.
+    external = forces - weight_forces
+    capacity = member_info["Fy"]*member_info["area"]
+
+    # Yielding: Fy*A*a >= goal*|external + weight_forces*a|, which is linear
+    # in a on either side of zero force
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factors = np.zeros(len(forces))
+        for sign in [1, -1]:
+            slope = capacity - sign*fos_yielding_goal*weight_forces
+            bound = sign*fos_yielding_goal*external/slope
+            factors = np.maximum(factors, np.where(slope > 0, bound, 0.0))
+    infeasible = capacity*factors < fos_yielding_goal*np.abs(
+        external + weight_forces*factors)*(1 - 1e-9)
+    factors[infeasible] = 1.0
+
+    # Buckling: P*a^2 >= -goal*(external + weight_forces*a), with P the
+    # Euler load, so a is the larger root of a quadratic. Without a real
+    # root the member is not in compression for any area.
+    euler = np.pi**2*member_info["elastic_modulus"]*member_info["I"] \
+        / member_info["length"]**2
+    b = fos_buckling_goal*weight_forces
+    c = fos_buckling_goal*external
+    discriminant = b**2 - 4*euler*c
+    with np.errstate(divide='ignore', invalid='ignore'):
+        buckling = np.where(discriminant >= 0,
+                            (-b + np.sqrt(np.maximum(discriminant, 0)))
+                            / (2*euler), 0.0)
+    factors = np.maximum(factors, np.nan_to_num(buckling))
+    return factors, infeasible
+
+
+def deflection_areas(contributions, weights, areas, deflection_goal,
+                     move_limit):
+    # Minimum-weight areas that bring a deflection sum(c/A) to the goal,
+    # by the optimality criterion A = sqrt(lambda*c/w) over the members
+    # whose area is not already set by their FOS (areas). Members with a
+    # negative or no contribution keep the areas they have.
+    active = contributions > 0
+    required = areas.copy()
+    for _ in range(len(areas)):
+        budget = deflection_goal - np.sum(contributions[~active]
+                                          / areas[~active])
+        if budget <= 0 or not np.any(active):
+            # The goal cannot be met by the active members alone this
+            # iteration, so grow them as far as allowed
+            required[active] = areas[active]*move_limit**2
+            return required
+        multiplier = np.sum(np.sqrt(contributions[active]*weights[active])) \
+            / budget
+        required[active] = multiplier*np.sqrt(contributions[active]
+                                              / weights[active])
+        passive = active & (required <= areas)
+        if not np.any(passive):
+            break
+        required[passive] = areas[passive]
+        active &= ~passive
+    return np.maximum(required, areas)
+
+
+def optimize_sections(the_truss, max_iterations=50, tol=1e-3, move_limit=2.0,
+                      min_scale=0.1, solver="auto"):
+    # Resize the members of the_truss for minimum mass under its design
+    # goals, by scaling the dimensions of every member. Each iteration is
+    # one factorization: members are resized from the sensitivities of
+    # their forces and FOS to their areas (a fully stressed design step)
+    # and, with a deflection goal, from the virtual work sensitivities of
+    # the largest deflection. The self-weight and virtual load cases are
+    # solved with the factorization of the analysis, and so is the final
+    # analysis after convergence, but a factorization is not carried to
+    # the next iteration: that resizes nearly every member, far more than
+    # the max_updates low-rank updates of the cache can take. Members
+    # shrink to at most min_scale of their starting size, and change by at
+    # most move_limit per iteration.
+    goals = the_truss.goals
+    fos_total_goal = goals["min_fos_total"] if goals["min_fos_total"] != -1 \
+        else 1.0
+    fos_yielding_goal = max(fos_total_goal, goals["min_fos_yielding"])
+    fos_buckling_goal = max(fos_total_goal, goals["min_fos_buckling"])
+    deflection_goal = goals["max_deflection"]
+
+    data = the_truss.member_arrays
+    m = data.count
+    n = the_truss.joint_arrays.count
+    initial = dict((key, getattr(data, key)[:m].copy())
+                   for key in dimensions + ["area", "I"])
+    arbitrary = data.shape[:m] == member.Member.shapes.index("arbitrary")
+    scale = np.ones(m)
+
+    history = {"mass": [], "fos_total": [], "deflection": []}
+    solves = 0
+    converged = False
+    infeasible = np.zeros(m, dtype=bool)
+    deflection_infeasible = False
+    iteration = -1
+    for iteration in range(max_iterations):
+        the_truss.calc_mass()
+        the_truss.calc_fos(solver=solver, condition="off")
+        solves += 1
+        member_info = the_truss.calc_member_info()
+        forces = data.force[:m]
+
+        deflections = the_truss.joint_arrays.deflections[:n]
+        norms = np.sqrt(np.sum(deflections**2, axis=1))
+        worst = int(np.argmax(norms)) if n > 0 else 0
+        history["mass"].append(the_truss.mass)
+        history["fos_total"].append(the_truss.fos_total)
+        history["deflection"].append(norms[worst] if n > 0 else 0.0)
+
+        # Member forces from self-weight and, with a deflection goal, from
+        # a unit load along the largest deflection, in one more solve with
+        # the cached factorization
+        truss_info = the_truss.calc_truss_info()
+        cases = [the_truss.calc_self_weight()]
+        use_deflection = deflection_goal != -1 and n > 0 and norms[worst] > 0
+        if use_deflection:
+            virtual_loads = np.zeros([3, n])
+            virtual_loads[:, worst] = deflections[worst]/norms[worst]
+            cases.append(virtual_loads)
+        truss_info["loads"] = np.array(cases)
+        case_forces = evaluate.the_forces(
+            truss_info, solver=solver, partition=the_truss._partition,
+            condition="off", cache=the_truss._factorization_cache,
+            max_updates=the_truss.max_updates)[0]
+        weight_forces = case_forces[0]
+
+        factors, infeasible = required_areas(
+            forces, weight_forces, member_info, fos_yielding_goal,
+            fos_buckling_goal)
+
+        if use_deflection:
+            # The deflection from self-weight does not change with uniform
+            # growth of a member, so only the rest is sized for. If that
+            # alone is over the goal, no sizes can meet it.
+            areas = member_info["area"]
+            external = -evaluate.deflection_sensitivity(
+                forces - weight_forces, case_forces[1], member_info)*areas**2
+            weight = -evaluate.deflection_sensitivity(
+                weight_forces, case_forces[1], member_info)*areas
+            budget = deflection_goal - np.sum(weight)
+            deflection_infeasible = budget <= 0
+            if not deflection_infeasible:
+                required = deflection_areas(
+                    external, data.rho[:m]*member_info["length"],
+                    areas*factors, budget, move_limit)
+                factors = required/areas
+
+        step = np.clip(np.sqrt(factors), 1/move_limit, move_limit)
+        step = np.maximum(step, min_scale/scale)
+        if np.max(np.abs(step - 1)) < tol:
+            converged = True
+            break
+
+        # Scale the dimensions, or area and I of arbitrary members
+        scale *= step
+        for key in dimensions:
+            getattr(data, key)[:m] = initial[key]*scale
+        data.area[:m][arbitrary] = initial["area"][arbitrary] \
+            * scale[arbitrary]**2
+        data.I[:m][arbitrary] = initial["I"][arbitrary]*scale[arbitrary]**4
+        the_truss.update_properties()
+
+    # The final analysis, with a condition estimate. After convergence it
+    # reuses the factorization of the last iteration.
+    the_truss.calc_mass()
+    the_truss.calc_fos(solver=solver)
+    if not converged:
+        solves += 1
+    if np.any(infeasible):
+        warnings.warn("The self-weight of members " +
+                      str(np.flatnonzero(infeasible).tolist()) +
+                      " alone exceeds the yielding goal at any size.")
+    if deflection_infeasible:
+        warnings.warn("The deflection from self-weight alone exceeds the "
+                      "max_deflection goal at any size.")
+    if goals["max_mass"] != -1 and the_truss.mass > goals["max_mass"]:
+        warnings.warn("The lightest design found has a mass of " +
+                      str(the_truss.mass) + ", more than the max_mass goal.")
+
+    return {"converged": converged,
+            "iterations": iteration + 1,
+            "solves": solves,
+            "scale": scale,
+            "infeasible": np.flatnonzero(infeasible),
+            "history": history}
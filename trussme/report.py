@@ -1,6 +1,10 @@
+import re
 import numpy as np
-import pandas as pd
 import trussme.physical_properties as pp
+from trussme import member
+
+# A fixed-point number, with optional leading space and sign
+FIXED_POINT = re.compile(r"^\s*[\+-]?[0-9]+\.[0-9]*$")
 
 
 def print_summary(f, the_truss, verb=False):
@@ -78,199 +82,119 @@ def print_summary(f, the_truss, verb=False):
 
 
 def print_instantiation_information(f, the_truss, verb=False):
+    joints = the_truss.joint_arrays
+    members = the_truss.member_arrays
+    n = joints.count
+    m = members.count
+
     pw(f, "\n", v=verb)
     pw(f, "(1) INSTANTIATION INFORMATION", v=verb)
     pw(f, "=============================", v=verb)
 
     # Print joint information
     pw(f, "\n--- JOINTS ---", v=verb)
-    data = []
-    rows = []
-    for j in the_truss.joints:
-        rows.append("Joint_"+"{0:02d}".format(j.idx))
-        data.append([str(j.coordinates[0]),
-                     str(j.coordinates[1]),
-                     str(j.coordinates[2]),
-                     str(bool(j.translation[0][0])),
-                     str(bool(j.translation[1][0])),
-                     str(bool(j.translation[2][0]))])
-
-    pw(f, pd.DataFrame(data,
-                           index=rows,
-                           columns=["X",
-                                    "Y",
-                                    "Z",
-                                    "X-Support",
-                                    "Y-Support",
-                                    "Z-Support"])
-        .to_string(justify="left"), v=verb)
+    coordinates = joints.coordinates[:n].T.tolist()
+    support = (joints.translation[:n].T != 0).tolist()
+    pw(f, format_table(labels("Joint_", n),
+                       ["X", "Y", "Z", "X-Support", "Y-Support",
+                        "Z-Support"],
+                       [[str(x) for x in column] for column in coordinates]
+                       + [[str(x) for x in column] for column in support]),
+       v=verb)
 
     # Print member information
     pw(f, "\n--- MEMBERS ---", v=verb)
-    data = []
-    rows = []
-    for m in the_truss.members:
-        rows.append("Member_"+"{0:02d}".format(m.idx))
-        data.append([str(m.joints[0].idx),
-                     str(m.joints[1].idx),
-                     m.material,
-                     m.shape,
-                     m.h,
-                     m.w,
-                     m.r,
-                     m.t])
-
-    pw(f, pd.DataFrame(data,
-                           index=rows,
-                           columns=["Joint-A",
-                                    "Joint-B",
-                                    "Material",
-                                    "Shape",
-                                    "Height",
-                                    "Width",
-                                    "Radius",
-                                    "Thickness"])
-        .to_string(justify="left"), v=verb)
+    connections = members.connections[:m].T.tolist()
+    shapes = [member.Member.shapes[code] for code in members.shape[:m].tolist()]
+    pw(f, format_table(labels("Member_", m),
+                       ["Joint-A", "Joint-B", "Material", "Shape", "Height",
+                        "Width", "Radius", "Thickness"],
+                       [[str(x) for x in column] for column in connections]
+                       + [members.material[:m].tolist(), shapes]
+                       + [not_available(getattr(members, key)[:m])
+                          for key in ["h", "w", "r", "t"]]),
+       v=verb)
 
     # Print material list
-    unique_materials = np.unique([m.material for m in the_truss.members])
+    unique_materials = np.unique(members.material[:m].astype(str))
     pw(f, "\n--- MATERIALS ---", v=verb)
-    data = []
-    rows = []
-    for mat in unique_materials:
-        rows.append(mat)
-        data.append([
-            str(pp.materials[mat]["rho"]),
-            str(pp.materials[mat]["E"]),
-            str(pp.materials[mat]["Fy"])])
-
-    pw(f, pd.DataFrame(data,
-                       index=rows,
-                       columns=["Density",
-                                "Elastic Modulus",
-                                "Yield Strength"])
-        .to_string(justify="left"), v=verb)
+    pw(f, format_table(list(unique_materials),
+                       ["Density", "Elastic Modulus", "Yield Strength"],
+                       [[str(pp.materials[mat][key])
+                         for mat in unique_materials]
+                        for key in ["rho", "E", "Fy"]]),
+       v=verb)
 
     # Print physical properties
-    unique_materials = np.unique([m.material for m in the_truss.members])
     pw(f, "\n--- PHYSICAL PROPERTIES ---", v=verb)
-    data = []
-    rows = []
-    rows.append("Grav. constant g")
-    data.append([
-        str(the_truss.g[0]),
-        str(the_truss.g[1]),
-        str(the_truss.g[2])])
-
-    pw(f, pd.DataFrame(data,
-                       index=rows,
-                       columns=["X-Component",
-                                "Y-Component",
-                                "Z-Component"])
-        .to_string(justify="left"), v=verb)
+    pw(f, format_table(["Grav. constant g"],
+                       ["X-Component", "Y-Component", "Z-Component"],
+                       [[str(x)] for x in np.asarray(the_truss.g,
+                                                     dtype=float).tolist()]),
+       v=verb)
 
 
 def print_stress_analysis(f, the_truss, verb=False):
+    joints = the_truss.joint_arrays
+    members = the_truss.member_arrays
+    n = joints.count
+    m = members.count
+    free = (joints.translation[:n].T == 0).tolist()
+
     pw(f, "\n", v=verb)
     pw(f, "(2) STRESS ANALYSIS INFORMATION", v=verb)
     pw(f, "===============================", v=verb)
 
     # Print information about loads
     pw(f, "\n--- LOADING ---", v=verb)
-    data = []
-    rows = []
-    for j in the_truss.joints:
-        rows.append("Joint_"+"{0:02d}".format(j.idx))
-        data.append([str(j.loads[0][0]),
-                     str(j.loads[1][0]),
-                     str(j.loads[2][0])])
-
-    pw(f, pd.DataFrame(data,
-                           index=rows,
-                           columns=["X-Load",
-                                    "Y-Load",
-                                    "Z-Load"])
-        .to_string(justify="left"), v=verb)
+    pw(f, format_table(labels("Joint_", n),
+                       ["X-Load", "Y-Load", "Z-Load"],
+                       [[str(x) for x in column]
+                        for column in joints.loads[:n].T.tolist()]),
+       v=verb)
 
     # Print information about weights
     pw(f, "\n--- WEIGHT LOADING ---", v=verb)
-    data = []
-    rows = []
-    for j in the_truss.joints:
-        rows.append("Joint_"+"{0:02d}".format(j.idx))
-        data.append([format(sum([m.mass/2.0*the_truss.g[0] for m in j.members]), '.2f'),
-                     format(sum([m.mass/2.0*the_truss.g[1] for m in j.members]), '.2f'),
-                     format(sum([m.mass/2.0*the_truss.g[2] for m in j.members]), '.2f'),])
-
-    pw(f, pd.DataFrame(data,
-                           index=rows,
-                           columns=["X-Weight",
-                                    "Y-Weight",
-                                    "Z-Weight"])
-        .to_string(justify="left"), v=verb)
+    pw(f, format_table(labels("Joint_", n),
+                       ["X-Weight", "Y-Weight", "Z-Weight"],
+                       [[format(x, '.2f') for x in column]
+                        for column in the_truss.calc_self_weight().tolist()]),
+       v=verb)
 
     # Print information about reactions
     pw(f, "\n--- REACTIONS ---", v=verb)
-    data = []
-    rows = []
-    for j in the_truss.joints:
-        rows.append("Joint_"+"{0:02d}".format(j.idx))
-        data.append([format(j.reactions[0][0], '.2f')
-                     if j.translation[0][0] != 0.0 else "N/A",
-                     format(j.reactions[1][0], '.2f')
-                     if j.translation[1][0] != 0.0 else "N/A",
-                     format(j.reactions[2][0], '.2f')
-                     if j.translation[2][0] != 0.0 else "N/A"])
-
-    pw(f, pd.DataFrame(data,
-                           index=rows,
-                           columns=["X-Reaction",
-                                    "Y-Reaction",
-                                    "Z-Reaction"])
-        .to_string(justify="left"), v=verb)
+    pw(f, format_table(labels("Joint_", n),
+                       ["X-Reaction", "Y-Reaction", "Z-Reaction"],
+                       [["N/A" if is_free else format(x, '.2f')
+                         for x, is_free in zip(column, free_column)]
+                        for column, free_column in zip(
+                            joints.reactions[:n].T.tolist(), free)]),
+       v=verb)
 
     # Print information about members
     pw(f, "\n--- FORCES AND STRESSES ---", v=verb)
-    data = []
-    rows = []
-    for m in the_truss.members:
-        rows.append("Member_"+"{0:02d}".format(m.idx))
-        data.append([m.area,
-                     format(m.I, '.2e'),
-                     format(m.force, '.2f'),
-                     format(m.stress, '.2f'),
-                     m.fos_yielding,
-                     m.fos_buckling if m.fos_buckling > 0 else "N/A"])
-
-    pw(f, pd.DataFrame(data,
-                           index=rows,
-                           columns=["Area",
-                                    "Moment-of-Inertia",
-                                    "Axial-force",
-                                    "Axial-stress",
-                                    "FOS-yielding",
-                                    "FOS-buckling"])
-        .to_string(justify="left"), v=verb)
+    pw(f, format_table(labels("Member_", m),
+                       ["Area", "Moment-of-Inertia", "Axial-force",
+                        "Axial-stress", "FOS-yielding", "FOS-buckling"],
+                       [members.area[:m].tolist(),
+                        [format(x, '.2e') for x in members.I[:m].tolist()],
+                        [format(x, '.2f') for x in members.force[:m].tolist()],
+                        [format(x, '.2f') for x in
+                         members.stress[:m].tolist()],
+                        members.fos_yielding[:m].tolist(),
+                        [x if x > 0 else "N/A" for x in
+                         members.fos_buckling[:m].tolist()]]),
+       v=verb)
 
     # Print information about members
     pw(f, "\n--- DEFLECTIONS ---", v=verb)
-    data = []
-    rows = []
-    for j in the_truss.joints:
-        rows.append("Joint_"+"{0:02d}".format(j.idx))
-        data.append([format(j.deflections[0][0], '.5f')
-                     if j.translation[0][0] == 0.0 else "N/A",
-                     format(j.deflections[1][0], '.5f')
-                     if j.translation[1][0] == 0.0 else "N/A",
-                     format(j.deflections[2][0], '.5f')
-                     if j.translation[2][0] == 0.0 else "N/A"])
-
-    pw(f, pd.DataFrame(data,
-                           index=rows,
-                           columns=["X-Defl.",
-                                    "Y-Defl.",
-                                    "Z-Defl."])
-        .to_string(justify="left"), v=verb)
+    pw(f, format_table(labels("Joint_", n),
+                       ["X-Defl.", "Y-Defl.", "Z-Defl."],
+                       [[format(x, '.5f') if is_free else "N/A"
+                         for x, is_free in zip(column, free_column)]
+                        for column, free_column in zip(
+                            joints.deflections[:n].T.tolist(), free)]),
+       v=verb)
 
 
 def print_recommendations(f, the_truss, verb=False):
@@ -358,3 +282,81 @@ def pw(f, string, nl=True, v=False):
             print(string)
         if f != "":
             f.write(string+"\n")
+
+
+def labels(prefix, count):
+    # Row labels such as Joint_00, Joint_01, ...
+    return [prefix + "{0:02d}".format(i) for i in range(count)]
+
+
+def not_available(values):
+    # Floats, with NaN shown as N/A
+    return ["N/A" if x != x else x for x in values.tolist()]
+
+
+def format_float(x, spec):
+    return "NaN" if x != x else format(x, spec)
+
+
+def trim_zeros(strings):
+    # Trim trailing zeros equally from every fixed-point number, leaving at
+    # least one digit after the decimal point
+    numbers = [i for i, x in enumerate(strings)
+               if FIXED_POINT.match(x) is not None]
+    trimmed = list(strings)
+    while len(numbers) > 0 and all(trimmed[i].endswith("0")
+                                   for i in numbers):
+        for i in numbers:
+            trimmed[i] = trimmed[i][:-1]
+    for i in numbers:
+        if trimmed[i].endswith("."):
+            trimmed[i] += "0"
+    return trimmed
+
+
+def format_column(values):
+    # Strings for a column of floats and/or strings, in the layout a plain
+    # text table of mixed columns has always used: floats in an all-float
+    # column share six decimals (or exponent notation, if the values need
+    # it) trimmed of common trailing zeros, floats in a mixed column are
+    # trimmed one by one, and everything is right-aligned with a leading
+    # space.
+    if all(isinstance(x, float) for x in values):
+        strings = trim_zeros([format_float(x, ' .6f') for x in values])
+        magnitudes = np.abs(np.array(values))
+        has_large = np.any(magnitudes > 1e6)
+        has_small = np.any((magnitudes < 1e-6) & (magnitudes > 0))
+        too_long = max(len(x) for x in strings) > 12
+        if has_small or (too_long and has_large):
+            strings = [format_float(x, ' .6e') for x in values]
+    else:
+        strings = []
+        for x in values:
+            if isinstance(x, float) and x == x:
+                x = format(x, ' .6f').rstrip("0")
+                strings.append(x + "0" if x.endswith(".") else x)
+            else:
+                strings.append(" " + ("NaN" if x != x else str(x)))
+    width = max(len(x) for x in strings)
+    return [x.rjust(width) for x in strings]
+
+
+def format_table(rows, columns, data):
+    # Fixed-width text table with left-justified headers, given the row
+    # labels, the column headers and the data as one list per column
+    if len(rows) == 0:
+        return "Empty DataFrame\nColumns: [" + ", ".join(columns) + \
+            "]\nIndex: []"
+
+    # Each block is a header followed by one string per row
+    blocks = [[""] + [str(x) for x in rows]]
+    for header, values in zip(columns, data):
+        strings = format_column(values)
+        if all(isinstance(x, float) for x in values):
+            header = " " + header
+        blocks.append([header] + strings)
+
+    widths = [max(len(x) for x in block) for block in blocks]
+    blocks = [[x.ljust(width) for x in block]
+              for block, width in zip(blocks, widths)]
+    return "\n".join(" ".join(line) for line in zip(*blocks))
@@ -0,0 +1,145 @@
+import collections
+import json
+import numpy as np
+
+# Rows written per chunk when streaming a table to a file
+CHUNK_SIZE = 10000
+
+tables = ["members", "joints"]
+
+
+class Results(object):
+    # Results of one analysis as arrays, as returned by Truss.results(). The
+    # member and joint tables are column-oriented, one array per column.
+
+    def __init__(self, members, joints, summary):
+        self.members = members
+        self.joints = joints
+        self.summary = summary
+
+    # Member results, shape (number_of_members,)
+    @property
+    def force(self):
+        return self.members["force"]
+
+    @property
+    def stress(self):
+        return self.members["stress"]
+
+    @property
+    def fos_yielding(self):
+        return self.members["fos_yielding"]
+
+    @property
+    def fos_buckling(self):
+        return self.members["fos_buckling"]
+
+    # Joint results, shape (number_of_joints, 3)
+    @property
+    def deflections(self):
+        return np.column_stack([self.joints["deflection_" + axis]
+                                for axis in "xyz"])
+
+    @property
+    def reactions(self):
+        return np.column_stack([self.joints["reaction_" + axis]
+                                for axis in "xyz"])
+
+    # Truss results
+    @property
+    def mass(self):
+        return self.summary["mass"]
+
+    @property
+    def limit_state(self):
+        return self.summary["limit_state"]
+
+    @property
+    def condition(self):
+        return self.summary["condition"]
+
+    def table(self, name):
+        if name not in tables:
+            raise ValueError(str(name)+' is not a defined table. Try ' +
+                             ', '.join(tables) + '.')
+        return getattr(self, name)
+
+    def write_json(self, file_name, chunk_size=CHUNK_SIZE):
+        # Column-oriented JSON. Columns are written a chunk at a time, so the
+        # whole document is never held in memory. Non-finite values, such as
+        # the FOS of an unloaded member, are written as null.
+        with open(file_name, "w") as f:
+            f.write('{"summary": ' + json.dumps(dict(
+                (key, finite(value)) for key, value in self.summary.items())))
+            for name in tables:
+                f.write(', ' + json.dumps(name) + ': {')
+                for i, (column, values) in enumerate(
+                        self.table(name).items()):
+                    f.write((', ' if i > 0 else '') + json.dumps(column) +
+                            ': [')
+                    for start in range(0, len(values), chunk_size):
+                        chunk = [finite(x) for x in
+                                 values[start:start + chunk_size].tolist()]
+                        f.write((', ' if start > 0 else '') +
+                                json.dumps(chunk)[1:-1])
+                    f.write(']')
+                f.write('}')
+            f.write('}\n')
+
+    def write_csv(self, file_name, table="members", chunk_size=CHUNK_SIZE):
+        # One row per member or joint, written a chunk of rows at a time
+        columns = self.table(table)
+        with open(file_name, "w") as f:
+            f.write(",".join(columns.keys()) + "\n")
+            for start in range(0, len(columns["id"]), chunk_size):
+                rows = zip(*[values[start:start + chunk_size].tolist()
+                             for values in columns.values()])
+                f.write("".join(",".join(repr(x) for x in row) + "\n"
+                                for row in rows))
+
+    def write_npz(self, file_name):
+        # Columnar NumPy archive, with keys such as "members.force"
+        arrays = {"summary": np.array(json.dumps(self.summary))}
+        for name in tables:
+            for column, values in self.table(name).items():
+                arrays[name + "." + column] = values
+        np.savez(file_name, **arrays)
+
+    def write_parquet(self, file_name, table="members",
+                      chunk_size=CHUNK_SIZE):
+        # Columnar Parquet file, one row group per chunk of rows. pyarrow is
+        # imported here, since it is slow to import and rarely needed.
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow.")
+        columns = self.table(table)
+        schema = pyarrow.schema(
+            [(column, pyarrow.from_numpy_dtype(values.dtype))
+             for column, values in columns.items()],
+            metadata={"summary": json.dumps(self.summary)})
+        with pyarrow.parquet.ParquetWriter(file_name, schema) as writer:
+            for start in range(0, max(len(columns["id"]), 1), chunk_size):
+                writer.write_table(pyarrow.table(
+                    [values[start:start + chunk_size]
+                     for values in columns.values()], schema=schema))
+
+
+def finite(x):
+    # JSON has no NaN or infinity, so those become null
+    if isinstance(x, float) and not np.isfinite(x):
+        return None
+    return x
+
+
+def read_npz(file_name):
+    # Results written by Results.write_npz
+    with np.load(file_name) as data:
+        summary = json.loads(str(data["summary"]))
+        columns = dict((name, collections.OrderedDict()) for name in tables)
+        for key in data.files:
+            if key != "summary":
+                name, column = key.split(".", 1)
+                columns[name][column] = data[key]
+    return Results(columns["members"], columns["joints"], summary)
@@ -0,0 +1,151 @@
+import multiprocessing
+import numpy as np
+from trussme import batch
+from trussme import evaluate
+from trussme import fileio
+from trussme import member
+
+# Shape parameters a sweep can vary, and the shapes they apply to. area and
+# I are only used by arbitrary members, the others only where the base
+# truss has a value.
+parameters = ["t", "w", "h", "r", "area", "I"]
+
+
+def sweep_base(the_truss):
+    # Everything about the base truss that the variants share, as plain
+    # arrays, so it can be sent to worker processes
+    the_truss.update_properties()
+    m = the_truss.member_arrays.count
+    base = the_truss.calc_truss_info()
+    base["loads"] = the_truss.joint_arrays.loads[
+        :the_truss.joint_arrays.count].T.copy()
+    base["g"] = np.asarray(the_truss.g, dtype=float)
+    for name in ["shape", "material", "length"] + parameters:
+        base[name] = getattr(the_truss.member_arrays, name)[:m].copy()
+    return base
+
+
+def expand_variants(base, variant_parameters, materials):
+    # Per-variant, per-member arrays of the shape parameters and materials.
+    # Values may be given per variant, shape (k,), or per variant and
+    # member, shape (k, m).
+    m = len(base["shape"])
+    values = {}
+    for key, value in variant_parameters.items():
+        if key not in fileio.parameter_names:
+            raise ValueError(key+' is not a defined parameter. '
+                             'Try thickness (t), width (w), '
+                             'height (h), radius (r), area (a) or I_min.')
+        value = np.asarray(value, dtype=float)
+        if value.ndim == 1:
+            value = np.repeat(value[:, None], m, axis=1)
+        values[fileio.parameter_names[key]] = value
+    if materials is not None:
+        materials = np.asarray(materials, dtype=object)
+        if materials.ndim == 1:
+            materials = np.repeat(materials[:, None], m, axis=1)
+
+    if len(values) == 0 and materials is None:
+        raise ValueError("No variants given. Try parameters or materials.")
+    counts = set(len(value) for value in values.values())
+    if materials is not None:
+        counts.add(len(materials))
+    if len(counts) != 1:
+        raise ValueError("Parameters and materials must have the same "
+                         "number of variants.")
+    k = counts.pop()
+
+    arbitrary = base["shape"] == member.Member.shapes.index("arbitrary")
+    variants = {}
+    for key in parameters:
+        variants[key] = np.repeat(base[key][None, :], k, axis=0)
+        if key in values:
+            applies = arbitrary if key in ["area", "I"] \
+                else ~np.isnan(base[key])
+            variants[key][:, applies] = values[key][:, applies]
+    variants["material"] = np.repeat(base["material"][None, :], k, axis=0) \
+        if materials is None else materials
+    return variants
+
+
+def evaluate_variants(base, variants, solver="auto"):
+    # Mass and FOS of every variant, with section properties, self-weight,
+    # forces and factors of safety computed for all variants at once
+    k, m = np.shape(variants["material"])
+    properties = fileio.material_properties(variants["material"].ravel())
+    sections = member.compute_properties_batch(
+        np.tile(base["shape"], k), variants["t"].ravel(),
+        variants["w"].ravel(), variants["h"].ravel(), variants["r"].ravel(),
+        properties["rho"], area=variants["area"].ravel(),
+        I=variants["I"].ravel(), length=np.tile(base["length"], k))
+    area = sections["area"].reshape([k, m])
+    elastic_modulus = properties["elastic_modulus"].reshape([k, m])
+    member_mass = sections["mass"].reshape([k, m])
+
+    number_of_joints = np.size(base["coordinates"], axis=1)
+    loads = base["loads"] + evaluate.self_weight(
+        base["connections"].T, member_mass, base["g"], number_of_joints)
+    forces, deflections = evaluate.batch_forces(
+        dict(base, area=area, elastic_modulus=elastic_modulus, loads=loads),
+        solver=solver)
+
+    results = evaluate.post_process(forces, {
+        "Fy": properties["Fy"].reshape([k, m]),
+        "area": area,
+        "elastic_modulus": elastic_modulus,
+        "I": sections["I"].reshape([k, m]),
+        "length": base["length"]})
+
+    # Variants with a singular stiffness matrix have NaN forces, so they
+    # have no limit state or governing member
+    failed = np.any(np.isnan(forces), axis=1)
+    return {"mass": np.sum(member_mass, axis=1),
+            "fos_total": results["truss_fos_total"],
+            "fos_yielding": results["truss_fos_yielding"],
+            "fos_buckling": results["truss_fos_buckling"],
+            "limit_state": np.where(failed, "failed",
+                                    results["limit_state"]),
+            "governing_member": np.where(failed, -1,
+                                         results["governing_member"])}
+
+
+def _evaluate(arguments):
+    # Pool workers take a single argument
+    return evaluate_variants(*arguments)
+
+
+def sweep(the_truss, variant_parameters=None, materials=None, solver="auto",
+          workers=1, chunk_size=256, threads_per_worker=1):
+    # Evaluate k variants of the_truss that differ in member section
+    # parameters and/or materials, without building a Truss per variant.
+    # variant_parameters maps parameter names (as in set_parameters) to
+    # arrays of shape (k,) or (k, m), and materials is a sequence of k
+    # material names or a (k, m) array of them. Returns a dict of arrays of
+    # length k: mass, fos_total, fos_yielding, fos_buckling, limit_state
+    # and governing_member. Variants with a singular stiffness matrix get
+    # NaN FOS, limit state "failed" and governing member -1. With several
+    # workers, chunks of chunk_size variants are evaluated on a process
+    # pool.
+    base = sweep_base(the_truss)
+    variants = expand_variants(base, variant_parameters or {}, materials)
+    k = len(variants["material"])
+
+    chunks = [dict((key, value[start:start + chunk_size])
+                   for key, value in variants.items())
+              for start in range(0, k, chunk_size)]
+    workers = max(1, min(workers, len(chunks)))
+    if workers == 1:
+        results = [evaluate_variants(base, chunk, solver) for chunk in chunks]
+    else:
+        context = multiprocessing.get_context("spawn")
+        with batch.blas_threads(threads_per_worker):
+            pool = context.Pool(workers)
+        try:
+            results = pool.map(_evaluate, [(base, chunk, solver)
+                                           for chunk in chunks])
+        finally:
+            pool.close()
+            pool.join()
+
+    return dict((key, np.concatenate([r[key] for r in results]))
+                for key in results[0])
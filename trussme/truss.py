@@ -5,19 +5,18 @@ from trussme import joint
 from trussme import member
 from trussme import report
 from trussme import evaluate
+from trussme import fileio
+from trussme import optimize
+from trussme import results
 from trussme.physical_properties import g
 import time
 import datetime
+import io
 import os
 import warnings
 # import random
 import itertools
-
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.cm as cm
-from matplotlib.font_manager import FontProperties
-from mpl_toolkits.mplot3d import proj3d
+import collections
 
 
 class Truss(object):
@@ -29,6 +28,10 @@ class Truss(object):
         # Make a list to store joints in
         self.joints = []
 
+        # Array storage behind the joints and members
+        self.joint_arrays = joint.JointArrays()
+        self.member_arrays = member.MemberArrays()
+
         # Variables to store number of joints and members
         self.number_of_joints = 0
         self.number_of_members = 0
@@ -39,6 +42,7 @@ class Truss(object):
         self.fos_buckling = 0
         self.fos_total = 0
         self.limit_state = ''
+        self.governing_member = -1
         self.condition = 0
         # Extract fallback values for g from physical properties:
         self.g = np.asarray(g)
@@ -51,44 +55,89 @@ class Truss(object):
                       "max_deflection": -1}
         self.THERE_ARE_GOALS = False
 
+        # Named load cases and the results of the last calc_load_cases
+        self.load_cases = collections.OrderedDict()
+        self.load_case_results = {}
+
+        # Joint self-weight loads, shared by the solver and the report
+        self._self_weight_key = None
+        self._self_weight = None
+
+        # Fingerprint of the model when the FOS was last computed, so
+        # unchanged models are not analyzed again
+        self._fos_key = None
+
+        # Factorization of the reduced stiffness matrix, kept between analyses
+        self._factorization_cache = {}
+
+        # Members whose section or material may change before the cached
+        # factorization is refactored instead of updated. 0 always refactors.
+        self.max_updates = evaluate.MAX_UPDATES
+
+        # Free/restrained DOF index arrays, cached per support layout
+        self._partition_key = None
+        self._partition = None
+
         if file_name != "":
-            with open(file_name, 'r') as f:
-                for idx, line in enumerate(f):
-                    if line[0] == "J":
-                        info = line.split()[1:]
-                        self.add_joint(np.array(
-                            [float(x) for x in info[:3]]))
-                        self.joints[-1].translation = np.array(
-                            [[int(x)] for x in info[3:]])
-                    elif line[0] == "M":
-                        info = line.split()[1:]
-                        self.add_member(int(info[0]), int(info[1]))
-                        self.members[-1].set_material(info[2])
-                        self.members[-1].set_shape(info[3])
-
-                        # Parse parameters
-                        ks = []
-                        vs = []
-                        for param in range(4, len(info)):
-                            kvpair = info[param].split("=")
-                            ks.append(kvpair[0])
-                            vs.append(float(kvpair[1]))
-                        self.members[-1].set_parameters(**dict(zip(ks, vs)))
-                    elif line[0] == "L":
-                        info = line.split()[1:]
-                        self.joints[int(info[0])].loads[0] = float(info[1])
-                        self.joints[int(info[0])].loads[1] = float(info[2])
-                        self.joints[int(info[0])].loads[2] = float(info[3])
-                    elif line[0] == "P":
-                        info = line.split()[1:]
-                        # If g is defined, overwrite fallback values
-                        if info[0] == "g":
-                            self.g = np.array([float(info[1]),
-                                               float(info[2]),
-                                               float(info[3])])
-                    elif line[0] != "#" and not line.isspace():
-                        raise ValueError("'"+line[0] +
-                                         "' is not a valid line beginner.")
+            if os.path.splitext(file_name)[1] == ".trsb":
+                self.build(fileio.read_trsb(file_name))
+            else:
+                self.build(fileio.read_trs(file_name))
+
+    def build(self, model):
+        # Add the joints, members and loads of a model dict (as returned by
+        # fileio.read_trs) in bulk, with a single property computation
+        first_joint = self.number_of_joints
+        number_of_joints = len(model["coordinates"])
+        rows = slice(self.joint_arrays.extend(number_of_joints),
+                     self.joint_arrays.count)
+        self.joint_arrays.coordinates[rows] = model["coordinates"]
+        self.joint_arrays.translation[rows] = model["translation"]
+        self.joint_arrays.loads[rows] = model["loads"]
+        for row in range(rows.start, rows.stop):
+            self.joints.append(joint.Joint.view(self.joint_arrays, row))
+        self.number_of_joints += number_of_joints
+
+        number_of_members = len(model["connections"])
+        rows = slice(self.member_arrays.extend(number_of_members),
+                     self.member_arrays.count)
+        data = self.member_arrays
+        connections = model["connections"] + first_joint
+        data.connections[rows] = connections
+        data.shape[rows] = model["shape"]
+        data.material[rows] = model["material"]
+        parameters = fileio.member_parameters(model["shape"],
+                                              model["parameters"])
+        for key in parameters:
+            getattr(data, key)[rows] = parameters[key]
+        properties = fileio.material_properties(model["material"])
+        for key in properties:
+            getattr(data, key)[rows] = properties[key]
+        fileio.check_parameters(model["shape"], parameters)
+
+        # One view per member, with its end joints looked up from a list
+        # rather than by indexing the array for every member
+        joints = self.joints
+        for row, (a, b) in zip(range(rows.start, rows.stop),
+                               connections.tolist()):
+            m = member.Member.view(data, row, (joints[a], joints[b]))
+            self.members.append(m)
+            joints[a].members.append(m)
+            joints[b].members.append(m)
+        self.number_of_members += number_of_members
+
+        for name in model["load_cases"]:
+            joints, loads = model["load_cases"][name]
+            self.add_load_case(name)
+            for joint_index, load in zip(joints, loads):
+                self.set_case_load(name, joint_index + first_joint, load)
+
+        # If g is defined, overwrite fallback values
+        if model["g"] is not None:
+            self.g = model["g"]
+
+        self.update_properties()
+        self.clear_factorization()
 
     def set_goal(self, **kwargs):
         self.THERE_ARE_GOALS = True
@@ -111,31 +160,63 @@ class Truss(object):
                                      'min_fos_buckling, '
                                      'max_mass, or max_deflection.')
 
+    def clear_factorization(self):
+        # The cache is also checked against a fingerprint of coordinates,
+        # connectivity, E, A and supports before every reuse. The next
+        # calc_fos solves again.
+        self._factorization_cache.clear()
+        self._fos_key = None
+
+    def ordering_stats(self):
+        # Time, bandwidth, profile and Cholesky fill before and after the
+        # DOF reordering of the last Cholesky, sparse or iterative analysis,
+        # how many times smaller the fill is after (fill_reduction), and
+        # the entries stored by its factorization (fill)
+        cache = self._factorization_cache
+        if "ordering" not in cache:
+            return {}
+        stats = dict(evaluate.ordering_fill(cache["ordering"]))
+        if "factorization" in cache:
+            stats["fill"] = cache["factorization"].fill
+        return stats
+
     def add_support(self, coordinates, d=3):
+        self.clear_factorization()
+
         # Make the joint
-        self.joints.append(joint.Joint(coordinates))
+        self.joints.append(joint.Joint(coordinates,
+                                       data=self.joint_arrays))
         self.joints[self.number_of_joints].pinned(d=d)
         self.joints[-1].idx = self.number_of_joints
         self.number_of_joints += 1
 
     def add_roller(self, coordinates, axis, d=3):
+        self.clear_factorization()
+
         # Make the joint
-        self.joints.append(joint.Joint(coordinates))
+        self.joints.append(joint.Joint(coordinates,
+                                       data=self.joint_arrays))
         self.joints[self.number_of_joints].roller(axis=axis, d=d)
         self.joints[-1].idx = self.number_of_joints
         self.number_of_joints += 1
 
     def add_joint(self, coordinates, d=3):
+        self.clear_factorization()
+
         # Make the joint
-        self.joints.append(joint.Joint(coordinates))
+        self.joints.append(joint.Joint(coordinates,
+                                       data=self.joint_arrays))
         self.joints[self.number_of_joints].free(d=d)
         self.joints[-1].idx = self.number_of_joints
         self.number_of_joints += 1
 
     def add_member(self, joint_index_a, joint_index_b):
+        self.clear_factorization()
+
         # Make a member
         self.members.append(member.Member(self.joints[joint_index_a],
-                                          self.joints[joint_index_b]))
+                                          self.joints[joint_index_b],
+                                          data=self.member_arrays))
 
         self.members[-1].idx = self.number_of_members
 
@@ -146,102 +227,275 @@ class Truss(object):
         self.number_of_members += 1
 
     def move_joint(self, joint_index, coordinates):
+        self.clear_factorization()
         self.joints[joint_index].coordinates = coordinates
 
+    def update_properties(self):
+        # Recompute area, I, linear weight, length and mass of all members
+        # in one vectorized pass
+        m = self.member_arrays.count
+        data = self.member_arrays
+        coordinates = self.joint_arrays.coordinates
+        data.length[:m] = member.calc_lengths(
+            coordinates[data.connections[:m, 0]],
+            coordinates[data.connections[:m, 1]])
+        properties = member.compute_properties_batch(
+            data.shape[:m], data.t[:m], data.w[:m], data.h[:m], data.r[:m],
+            data.rho[:m], area=data.area[:m], I=data.I[:m],
+            length=data.length[:m])
+        data.area[:m] = properties["area"]
+        data.I[:m] = properties["I"]
+        data.LW[:m] = properties["LW"]
+        data.mass[:m] = properties["mass"]
+
     def calc_mass(self):
-        self.mass = 0
-        for m in self.members:
-            self.mass += m.mass
+        m = self.member_arrays.count
+        self.mass = float(np.sum(self.member_arrays.mass[:m]))
 
     def set_load(self, joint_index, load):
-        self.joints[joint_index].load = load
-
-    def calc_fos(self):
-        # Pull supports and add to D
-        coordinates = []
-        for j in self.joints:
-            coordinates.append(j.coordinates)
-
-        # Build Re
-        reactions = np.zeros([3, self.number_of_joints])
-        loads = np.zeros([3, self.number_of_joints])
-        for i in range(len(self.joints)):
-            reactions[0, i] = self.joints[i].translation[0]
-            reactions[1, i] = self.joints[i].translation[1]
-            reactions[2, i] = self.joints[i].translation[2]
-            # member weights are distributed to the joints and
-            # added to existing loads
-            loads[0, i] = self.joints[i].loads[0]\
-                + sum([m.mass/2.0*self.g[0] for m in self.joints[i].members])
-            loads[1, i] = self.joints[i].loads[1]\
-                + sum([m.mass/2.0*self.g[1] for m in self.joints[i].members])
-            loads[2, i] = self.joints[i].loads[2]\
-                + sum([m.mass/2.0*self.g[2] for m in self.joints[i].members])
-
-        # Pull out E and A
-        elastic_modulus = []
-        area = []
-        connections = []
-        for m in self.members:
-            elastic_modulus.append(m.elastic_modulus)
-            area.append(m.area)
-            connections.append([j.idx for j in m.joints])
-
-        # Make everything an array
-        area = np.array(area)
-        elastic_modulus = np.array(elastic_modulus)
-        coordinates = np.array(coordinates).T
-        connections = np.array(connections).T
-
-        # Pull everything into a dict
-        truss_info = {"elastic_modulus": elastic_modulus,
-                      "coordinates": coordinates,
-                      "connections": connections,
-                      "reactions": reactions,
-                      "loads": loads,
-                      "area": area}
+        self.joints[joint_index].loads = load
+
+    def add_load_case(self, name, loads=None):
+        # A load case maps joint indices to [x, y, z] loads. It replaces the
+        # joint loads, while self-weight is always added on top.
+        self.load_cases[name] = {}
+        if loads is not None:
+            for joint_index in loads:
+                self.set_case_load(name, joint_index, loads[joint_index])
+
+    def set_case_load(self, name, joint_index, load):
+        if name not in self.load_cases:
+            raise ValueError(str(name)+' is not a defined load case. Try ' +
+                             ', '.join(str(k) for k in self.load_cases) +
+                             '.')
+        self.load_cases[name][int(joint_index)] = \
+            np.asarray(load, dtype=float).reshape(3)
+
+    def calc_self_weight(self):
+        # member weights are distributed to the joints. The result is cached
+        # until masses, connectivity or g change.
+        m = self.member_arrays.count
+        connections = self.member_arrays.connections[:m]
+        key = evaluate.fingerprint(self.member_arrays.mass[:m], connections,
+                                   self.g, self.number_of_joints)
+        if self._self_weight_key != key:
+            self._self_weight_key = key
+            self._self_weight = evaluate.self_weight(
+                connections, self.member_arrays.mass[:m], self.g,
+                self.number_of_joints)
+        return self._self_weight
+
+    def calc_truss_info(self):
+        # Everything is read straight from the array storage
+        n = self.joint_arrays.count
+        m = self.member_arrays.count
+        reactions = self.joint_arrays.translation[:n].T.astype(float)
+
+        # Only recompute the DOF partition when the supports have changed
+        if self._partition_key != reactions.tobytes():
+            self._partition_key = reactions.tobytes()
+            self._partition = evaluate.partition_dofs(reactions)
+
+        # Pull everything into a dict. Member weights are added to the
+        # existing loads.
+        return {"elastic_modulus": self.member_arrays.elastic_modulus[:m],
+                "coordinates": self.joint_arrays.coordinates[:n].T,
+                "connections": self.member_arrays.connections[:m].T,
+                "reactions": reactions,
+                "loads": self.joint_arrays.loads[:n].T
+                + self.calc_self_weight(),
+                "area": self.member_arrays.area[:m]}
+
+    def calc_member_info(self):
+        # Member properties needed for the factors of safety
+        m = self.member_arrays.count
+        return {"Fy": self.member_arrays.Fy[:m],
+                "area": self.member_arrays.area[:m],
+                "elastic_modulus": self.member_arrays.elastic_modulus[:m],
+                "I": self.member_arrays.I[:m],
+                "length": self.member_arrays.length[:m]}
+
+    def model_fingerprint(self):
+        # Hash of everything the analysis depends on: geometry, supports,
+        # loads, connectivity, sections, materials and g. Joints and
+        # members are views of the arrays, so this sees every change,
+        # including in-place edits such as joint.loads[1] = -1000.
+        n = self.joint_arrays.count
+        m = self.member_arrays.count
+        joints = self.joint_arrays
+        members = self.member_arrays
+        return evaluate.fingerprint(
+            joints.coordinates[:n], joints.translation[:n], joints.loads[:n],
+            members.connections[:m], members.elastic_modulus[:m],
+            members.Fy[:m], members.area[:m], members.I[:m],
+            members.length[:m], members.mass[:m], self.g)
+
+    def check_stability(self, rigidity=True):
+        # Raise a MechanismError that names the joints that can move if a
+        # quick look at the members and supports shows a mechanism. With
+        # rigidity, planar trusses are also checked for generic rigidity.
+        evaluate.check_stability(self.calc_truss_info(), self._partition,
+                                 rigidity=rigidity)
+
+    def calc_fos(self, solver="auto", condition="estimate", recompute=False,
+                 **options):
+        # The results of the last analysis are kept while the model and the
+        # options are unchanged, unless recompute is set. Other options,
+        # such as preconditioner, tol and maxiter, go to the iterative
+        # solver.
+        key = (self.model_fingerprint(), solver, condition,
+               repr(sorted(options.items())))
+        if not recompute and key == self._fos_key:
+            return
+        self._fos_key = None
+
+        truss_info = self.calc_truss_info()
 
         forces, deflections, reactions, self.condition = \
-            evaluate.the_forces(truss_info)
-
-        for i in range(self.number_of_members):
-            self.members[i].set_force(forces[i])
-
-        for i in range(self.number_of_joints):
-            for j in range(3):
-                if self.joints[i].translation[j]:
-                    self.joints[i].reactions[j] = reactions[j, i]
-                    self.joints[i].deflections[j] = 0.0
-                else:
-                    self.joints[i].reactions[j] = 0.0
-                    self.joints[i].deflections[j] = deflections[j, i]
-
-        # Pull out the member factors of safety
-        self.fos_buckling = min([m.fos_buckling if m.fos_buckling > 0
-                                 else 10000 for m in self.members])
-        self.fos_yielding = min([m.fos_yielding for m in self.members])
-
-        # Get total FOS and limit state
-        self.fos_total = min(self.fos_buckling, self.fos_yielding)
-        if self.fos_buckling < self.fos_yielding:
-            self.limit_state = 'buckling'
-        else:
-            self.limit_state = 'yielding'
-
-        if self.condition > pow(10, 5):
+            evaluate.the_forces(truss_info, solver=solver,
+                                partition=self._partition,
+                                condition=condition,
+                                cache=self._factorization_cache,
+                                max_updates=self.max_updates, **options)
+
+        # Stresses and factors of safety of all members at once
+        results = evaluate.post_process(forces, self.calc_member_info())
+
+        # Write the results to the member and joint arrays
+        m = self.member_arrays.count
+        self.member_arrays.force[:m] = forces
+        self.member_arrays.stress[:m] = results["stress"]
+        self.member_arrays.fos_yielding[:m] = results["fos_yielding"]
+        self.member_arrays.fos_buckling[:m] = results["fos_buckling"]
+
+        n = self.joint_arrays.count
+        supported = self.joint_arrays.translation[:n].T != 0
+        self.joint_arrays.reactions[:n] = np.where(supported, reactions, 0.0).T
+        self.joint_arrays.deflections[:n] = \
+            np.where(supported, 0.0, deflections).T
+
+        # Pull out the truss factors of safety and limit state
+        self.fos_buckling = results["truss_fos_buckling"]
+        self.fos_yielding = results["truss_fos_yielding"]
+        self.fos_total = results["truss_fos_total"]
+        self.limit_state = str(results["limit_state"])
+        self.governing_member = int(results["governing_member"])
+        self._fos_key = key
+
+        if self.condition > evaluate.CONDITION_LIMITS[condition]:
             warnings.warn("The condition number is " + str(self.condition) +
                           ". Results may be inaccurate.")
 
+    def results(self, solver="auto", condition="estimate", recompute=False,
+                **options):
+        # Run the analysis and return its results as arrays
+        self.calc_mass()
+        self.calc_fos(solver=solver, condition=condition, recompute=recompute,
+                      **options)
+
+        n = self.joint_arrays.count
+        m = self.member_arrays.count
+        members = collections.OrderedDict(
+            [("id", np.arange(m)),
+             ("joint_a", self.member_arrays.connections[:m, 0].copy()),
+             ("joint_b", self.member_arrays.connections[:m, 1].copy())])
+        for name in ["force", "stress", "fos_yielding", "fos_buckling",
+                     "area", "I", "length", "mass"]:
+            members[name] = getattr(self.member_arrays, name)[:m].copy()
+
+        joints = collections.OrderedDict([("id", np.arange(n))])
+        for i, axis in enumerate("xyz"):
+            joints[axis] = self.joint_arrays.coordinates[:n, i].copy()
+        for name in ["deflection", "reaction"]:
+            for i, axis in enumerate("xyz"):
+                joints[name + "_" + axis] = \
+                    getattr(self.joint_arrays, name + "s")[:n, i].copy()
+
+        summary = {"mass": float(self.mass),
+                   "fos_yielding": float(self.fos_yielding),
+                   "fos_buckling": float(self.fos_buckling),
+                   "fos_total": float(self.fos_total),
+                   "limit_state": self.limit_state,
+                   "governing_member": self.governing_member,
+                   "condition": float(self.condition)}
+        return results.Results(members, joints, summary)
+
+    def optimize_sections(self, goals=None, **kwargs):
+        # Size the members for minimum mass under the design goals. Options
+        # are passed on to optimize.optimize_sections.
+        if goals is not None:
+            self.set_goal(**goals)
+        return optimize.optimize_sections(self, **kwargs)
+
+    def calc_load_cases(self, solver="auto", condition="estimate",
+                        **options):
+        if len(self.load_cases) == 0:
+            raise ValueError('No load cases are defined. '
+                             'Try add_load_case first.')
+        truss_info = self.calc_truss_info()
+        names = list(self.load_cases.keys())
+
+        # Stack the load cases, each with the self-weight added
+        self_weight = self.calc_self_weight()
+        loads = np.zeros([len(names), 3, self.number_of_joints])
+        for k, name in enumerate(names):
+            loads[k] = self_weight
+            for joint_index, load in self.load_cases[name].items():
+                loads[k, :, joint_index] += load
+        truss_info["loads"] = loads
+
+        # One factorization, all load cases as one right-hand side matrix
+        forces, deflections, reactions, condition_number = \
+            evaluate.the_forces(truss_info, solver=solver,
+                                partition=self._partition,
+                                condition=condition,
+                                cache=self._factorization_cache,
+                                max_updates=self.max_updates, **options)
+
+        results = evaluate.post_process(forces, self.calc_member_info())
+        fos_yielding = results["fos_yielding"]
+        fos_buckling = results["fos_buckling"]
+
+        # Governing values per member over all load cases
+        fos_buckling_governing = np.where(fos_buckling > 0, fos_buckling,
+                                          evaluate.NO_BUCKLING_FOS)
+        fos_member = np.minimum(fos_yielding, fos_buckling_governing)
+        envelope = {"max_force": np.max(forces, axis=0),
+                    "min_force": np.min(forces, axis=0),
+                    "fos_yielding": np.min(fos_yielding, axis=0),
+                    "fos_buckling": np.min(fos_buckling_governing, axis=0),
+                    "governing_case": [names[k] for k in
+                                       np.argmin(fos_member, axis=0)]}
+
+        limit_state = list(results["limit_state"])
+        self.load_case_results = {"names": names,
+                                  "forces": forces,
+                                  "deflections": deflections,
+                                  "reactions": reactions,
+                                  "fos_yielding": fos_yielding,
+                                  "fos_buckling": fos_buckling,
+                                  "fos_total": results["truss_fos_total"],
+                                  "limit_state": limit_state,
+                                  "condition": condition_number,
+                                  "envelope": envelope}
+
+        if condition_number > evaluate.CONDITION_LIMITS[condition]:
+            warnings.warn("The condition number is " + str(condition_number) +
+                          ". Results may be inaccurate.")
+
+        return self.load_case_results
+
     def __report(self, file_name="", verb=False):
 
         # DO the calcs
         self.calc_mass()
         self.calc_fos()
 
+        # Collect the report in memory and write the file in one go
         if file_name == "":
             f = ""
         else:
-            f = open(file_name, 'w')
+            f = io.StringIO()
 
         # Print date and time
         global timestamp_pr
@@ -258,9 +512,9 @@ class Truss(object):
         if self.THERE_ARE_GOALS:
             report.print_recommendations(f, self, verb=verb)
 
-        # Try to close, and except if
         if file_name != "":
-            f.close()
+            with open(file_name, 'w') as out:
+                out.write(f.getvalue())
 
     def print_and_save_report(self, file_name):
         self.__report(file_name=file_name, verb=True)
@@ -271,54 +525,50 @@ class Truss(object):
     def save_report(self, file_name):
         self.__report(file_name=file_name, verb=False)
 
+    def model(self):
+        # The inverse of build: joints, members and loads as a dict of arrays
+        n = self.joint_arrays.count
+        m = self.member_arrays.count
+        load_cases = collections.OrderedDict()
+        for name in self.load_cases:
+            joints = sorted(self.load_cases[name])
+            load_cases[name] = (
+                np.array(joints, dtype=int),
+                np.array([self.load_cases[name][j] for j in joints],
+                         dtype=float).reshape([-1, 3]))
+        return {"coordinates": self.joint_arrays.coordinates[:n],
+                "translation": self.joint_arrays.translation[:n],
+                "loads": self.joint_arrays.loads[:n],
+                "connections": self.member_arrays.connections[:m],
+                "material": self.member_arrays.material[:m],
+                "shape": self.member_arrays.shape[:m],
+                "parameters": dict((key, getattr(self.member_arrays, key)[:m])
+                                   for key in ["t", "w", "h", "r", "area",
+                                               "I"]),
+                "load_cases": load_cases,
+                "g": np.asarray(self.g, dtype=float)}
+
     def save_truss(self, file_name=""):
         if file_name == "":
             file_name = time.strftime('%X %x %Z')
 
-        with open(file_name, "w") as f:
-            # Do the joints
-            load_string = ""
-            for j in self.joints:
-                f.write("J" + "\t"
-                        + str(j.coordinates[0]) + "\t"
-                        + str(j.coordinates[1]) + "\t"
-                        + str(j.coordinates[2]) + "\t"
-                        + str(j.translation[0, 0]) + "\t"
-                        + str(j.translation[1, 0]) + "\t"
-                        + str(j.translation[2, 0]) + "\n")
-                if np.sum(j.loads) != 0:
-                    load_string += "L" + "\t"
-                    load_string += str(j.idx) + "\t"
-                    load_string += str(j.loads[0, 0]) + "\t"
-                    load_string += str(j.loads[1, 0]) + "\t"
-                    load_string += str(j.loads[2, 0]) + "\t"
-                    load_string += "\n"
-
-            # Do the members
-            for m in self.members:
-                f.write("M" + "\t"
-                        + str(m.joints[0].idx) + "\t"
-                        + str(m.joints[1].idx) + "\t"
-                        + m.material + "\t"
-                        + m.shape + "\t")
-                if m.t != "N/A":
-                    f.write("t=" + str(m.t) + "\t")
-                if m.r != "N/A":
-                    f.write("r=" + str(m.r) + "\t")
-                if m.w != "N/A":
-                    f.write("w=" + str(m.w) + "\t")
-                if m.h != "N/A":
-                    f.write("h=" + str(m.h) + "\t")
-                f.write("\n")
-
-            # Do the loads
-            f.write(load_string)
+        # .trsb files use the binary container, everything else is text
+        if os.path.splitext(file_name)[1] == ".trsb":
+            fileio.write_trsb(self.model(), file_name)
+        else:
+            fileio.write_trs(self.model(), file_name)
 
     # =========================================================================
     # Achtung, ab hier auf eigene Faust!
     # =========================================================================
 
     def plot(self, mlbl=False, jlbl=False, ldlbl=False, legend=False):
+        # Plotting libraries are imported here rather than at module load, so
+        # headless analysis does not pay for them
+        import matplotlib.pyplot as plt
+        from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
+        from matplotlib.font_manager import FontProperties
+        from mpl_toolkits.mplot3d import proj3d
 
         # The following is a patch for mplot3d to enable orthogonal projection
         # http://stackoverflow.com/questions/23840756/how-to-disable-perspective-in-mplot3d